@@ -0,0 +1,309 @@
+"""
+Offline benchmark of the backup pipeline.
+Runs stream_backup, the pass a backup job makes, and upload_file_to_gdrive against a
+fake Telegram client and a local Drive server. It reports the throughput, request
+latency and peak memory of the whole pass and the upload, and of the fetch, download,
+archive and chat log stages inside the pass. Run from the repository root:
+
+    python benchmarks/bench.py --messages 5000 --media-ratio 0.3 --media-size-kb 512
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..', 'src'))
+STAGES = ('fetch', 'download', 'archive', 'chat_log', 'stream', 'gdrive')
+# Stages of stream_backup, taken from its job metrics, and the fake requests each makes
+STREAM_STAGES = {
+    'fetch': ('get_history',),
+    'download': ('get_file',),
+    'archive': (),
+    'chat_log': ('get_users', 'get_forum_topics'),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    group = parser.add_argument_group('synthetic history')
+    group.add_argument('--messages', type=int, default=2000)
+    group.add_argument('--topics', type=int, default=5)
+    group.add_argument('--no-forum', action='store_true', help='omit topic ids from reply headers so topics come from reply chains')
+    group.add_argument('--reply-depth', type=int, default=3)
+    group.add_argument('--reply-ratio', type=float, default=0.5)
+    group.add_argument('--media-ratio', type=float, default=0.3)
+    group.add_argument('--photo-ratio', type=float, default=0.5)
+    group.add_argument('--media-size-kb', type=int, default=256)
+    group.add_argument('--senders', type=int, default=50)
+    group.add_argument('--seed', type=int, default=0)
+    group = parser.add_argument_group('simulated Telegram')
+    group.add_argument('--latency-ms', type=float, default=20, help='round trip per request')
+    group.add_argument('--bandwidth-mbps', type=float, default=0, help='download bandwidth in MB/s (0 = unlimited)')
+    group.add_argument('--page-size', type=int, default=100)
+    group.add_argument('--flood-every', type=int, default=0, help='inject a FloodWait every N requests (0 = never)')
+    # Like Telegram's, the injected FloodWaits last a whole number of seconds, at least one
+    group.add_argument('--flood-wait', type=int, default=1, help='FloodWait length in whole seconds, at least 1')
+    group = parser.add_argument_group('simulated Google Drive')
+    group.add_argument('--drive-latency-ms', type=float, default=0)
+    group.add_argument('--drive-fail-every', type=int, default=0, help='answer every Nth chunk with 503 (0 = never)')
+    group.add_argument('--chunk-size-mb', type=int, default=None)
+    group = parser.add_argument_group('pipeline')
+    group.add_argument('--download-workers', type=int, default=None, help='Telegram requests in flight at the start')
+    group.add_argument('--compression-level', type=int, default=None)
+    group.add_argument('--volume-size-mb', type=int, default=None)
+    group.add_argument('--stages', default=','.join(STAGES), help=f'comma-separated subset of {",".join(STAGES)}')
+    group = parser.add_argument_group('output')
+    group.add_argument('--json', help='also write the results to this file')
+    group.add_argument('--no-tracemalloc', action='store_true', help='skip memory tracing, which slows Python code down')
+    group.add_argument('--keep', action='store_true', help='keep the temporary working directory')
+    group.add_argument('--verbose', action='store_true', help='show the bot\'s logs and progress bars')
+    args = parser.parse_args()
+    if args.flood_wait < 1:
+        parser.error('--flood-wait must be at least 1 second')
+    return args
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Stage:
+    """Measures one stage: wall time, requests made to the fakes and peak traced memory."""
+
+    def __init__(self, name, client, drive_state, quiet):
+        self.name = name
+        self.client = client
+        self.drive_state = drive_state
+        self.quiet = quiet
+        self.items = 0
+        self.bytes = 0
+        self.result = None
+
+    def __enter__(self):
+        self.calls_before = {kind: len(durations) for kind, durations in self.client.calls.items()}
+        self.drive_before = len(self.drive_state.request_times)
+        self.floods_before = self.client.flood_waits
+        self.throttled_before = self.client.flood_control.throttled_seconds if self.client.flood_control else 0
+        self.output = contextlib.redirect_stdout(io.StringIO()) if self.quiet else contextlib.nullcontext()
+        self.output.__enter__()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self.memory_before = tracemalloc.get_traced_memory()[0]
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.started
+        peak = tracemalloc.get_traced_memory()[1] - self.memory_before if tracemalloc.is_tracing() else None
+        self.output.__exit__(exc_type, exc, tb)
+        latencies = []
+        for kind, durations in self.client.calls.items():
+            latencies.extend(durations[self.calls_before.get(kind, 0):])
+        latencies.extend(self.drive_state.request_times[self.drive_before:])
+        p50, p95 = percentile(latencies, 0.5), percentile(latencies, 0.95)
+        self.result = {
+            'stage': self.name,
+            'seconds': seconds,
+            'busy_seconds': None,
+            'items': self.items,
+            'bytes': self.bytes,
+            'items_per_second': self.items / seconds if seconds else None,
+            'mb_per_second': self.bytes / seconds / 1024 / 1024 if seconds else None,
+            'requests': len(latencies),
+            'latency_p50_ms': p50 * 1000 if p50 is not None else None,
+            'latency_p95_ms': p95 * 1000 if p95 is not None else None,
+            'flood_waits': self.client.flood_waits - self.floods_before,
+            'throttled_seconds': self.client.flood_control.throttled_seconds - self.throttled_before if self.client.flood_control else None,
+            'peak_memory_mb': peak / 1024 / 1024 if peak is not None else None,
+        }
+
+
+def print_results(results):
+    columns = (
+        ('stage', 'stage', '{}'),
+        ('items', 'items', '{}'),
+        ('MB', 'bytes', '{:.1f}', 1 / 1024 / 1024),
+        ('seconds', 'seconds', '{:.2f}'),
+        ('busy s', 'busy_seconds', '{:.2f}'),
+        ('items/s', 'items_per_second', '{:.0f}'),
+        ('MB/s', 'mb_per_second', '{:.1f}'),
+        ('requests', 'requests', '{}'),
+        ('p50 ms', 'latency_p50_ms', '{:.1f}'),
+        ('p95 ms', 'latency_p95_ms', '{:.1f}'),
+        ('floods', 'flood_waits', '{}'),
+        ('held s', 'throttled_seconds', '{:.1f}'),
+        ('peak MB', 'peak_memory_mb', '{:.1f}'),
+    )
+    rows = [[title for title, *_ in columns]]
+    for result in results:
+        row = []
+        for title, key, fmt, *scale in columns:
+            value = result[key]
+            if value is None:
+                row.append('-')
+            else:
+                row.append(fmt.format(value * scale[0] if scale else value))
+        rows.append(row)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    for row in rows:
+        print('  '.join(cell.rjust(width) if i else cell.ljust(width) for i, (cell, width) in enumerate(zip(row, widths))))
+
+
+def setup_drive(upload, server):
+    """Point gdrive.upload at the local server with anonymous credentials."""
+    from google.auth.credentials import AnonymousCredentials
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+    document = json.loads(get_static_doc('drive', 'v3'))
+    document['rootUrl'] = f'http://127.0.0.1:{server.server_port}/'
+    upload._creds = AnonymousCredentials()
+    upload._service = build_from_document(document, credentials=upload._creds)
+    # Retries of injected failures should not sleep
+    upload._backoff = lambda attempt: 0
+
+
+def stream_stage_results(metrics, client, calls_before):
+    """
+    Results of the stages inside stream_backup. They overlap, so seconds is each stage's
+    wall-clock span and busy_seconds the sum of its operations across workers.
+    """
+    results = []
+    for name, kinds in STREAM_STAGES.items():
+        stats = metrics.stages.get(name)
+        if stats is None:
+            continue
+        seconds = stats.last_end - stats.first_start
+        latencies = [duration for kind in kinds for duration in client.calls.get(kind, [])[calls_before.get(kind, 0):]]
+        p50, p95 = percentile(latencies, 0.5), percentile(latencies, 0.95)
+        results.append({
+            'stage': name,
+            'seconds': seconds,
+            'busy_seconds': stats.busy_seconds,
+            'items': stats.items,
+            'bytes': stats.bytes,
+            'items_per_second': stats.items / seconds if seconds else None,
+            'mb_per_second': stats.bytes / seconds / 1024 / 1024 if seconds else None,
+            'requests': len(latencies),
+            'latency_p50_ms': p50 * 1000 if p50 is not None else None,
+            'latency_p95_ms': p95 * 1000 if p95 is not None else None,
+            'flood_waits': None,
+            'throttled_seconds': None,
+            'peak_memory_mb': None,
+        })
+    return results
+
+
+async def run(args, main, upload, client, drive_state, selected):
+    quiet = not args.verbose
+    results = []
+    workspace = os.path.join(main.JOBS_DIR, 'benchmark')
+    os.makedirs(workspace, exist_ok=True)
+    zip_file_path = os.path.join(workspace, 'benchmark.zip')
+    metrics = main.JobMetrics('benchmark')
+    volumes = []
+
+    async def on_volume_sealed(volume_path):
+        volumes.append(volume_path)
+
+    def stage(name):
+        return Stage(name, client, drive_state, quiet)
+
+    with stage('stream') as s:
+        job = main.StreamJob(main.GROUP_IDS[0], workspace, zip_file_path, main.DEFAULT_PASSWORD, 'Benchmark', metrics=metrics)
+        streamed, _ = await main.stream_backup(job, on_volume_sealed=on_volume_sealed)
+        s.items = len(streamed)
+        s.bytes = sum(os.path.getsize(path) for path in volumes)
+    results.extend(stream_stage_results(metrics, client, s.calls_before))
+    results.append(s.result)
+    if 'gdrive' in selected:
+        chunk_size = (args.chunk_size_mb or main.GDRIVE_CHUNK_SIZE_MB) * 1024 * 1024
+        with stage('gdrive') as s:
+            for volume_path in volumes:
+                upload.upload_file_to_gdrive(volume_path, chunk_size=chunk_size, adaptive_chunk_size=main.GDRIVE_ADAPTIVE_CHUNK_SIZE)
+            s.items = len(volumes)
+            s.bytes = sum(os.path.getsize(path) for path in volumes)
+        results.append(s.result)
+    shutil.rmtree(workspace, ignore_errors=True)
+    return [result for result in results if result['stage'] in selected]
+
+
+def main():
+    args = parse_args()
+    selected = [name.strip() for name in args.stages.split(',') if name.strip()]
+    unknown = set(selected) - set(STAGES)
+    if unknown:
+        sys.exit(f'Unknown stages: {", ".join(sorted(unknown))}')
+
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    work_dir = tempfile.mkdtemp(prefix='autocloud-bench-')
+    # main.py and gdrive/upload.py keep their state relative to the working directory
+    os.environ['AUTOCLOUD_CONFIG'] = os.path.join(BENCH_DIR, 'bench_config.ini')
+    os.chdir(work_dir)
+    sys.path.insert(0, SRC_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    import main as bot
+    from gdrive import upload
+    from fake_drive import start_server
+    from fake_telegram import FakeTelegramClient, generate_messages
+
+    if not args.verbose:
+        logging.getLogger('utils.colorlog').setLevel(logging.WARNING)
+    if args.download_workers:
+        # Downloads start at this many requests in flight and grow up to MAX_CONCURRENT_REQUESTS
+        bot.flood_control.limit = float(min(max(1, args.download_workers), bot.flood_control.maximum))
+    if args.compression_level is not None:
+        bot.COMPRESSION_LEVEL = args.compression_level
+    if args.volume_size_mb is not None:
+        bot.VOLUME_SIZE_MB = args.volume_size_mb
+
+    started = time.perf_counter()
+    messages, forum_topics = generate_messages(
+        args.messages, topics=args.topics, forum=not args.no_forum, reply_depth=args.reply_depth,
+        reply_ratio=args.reply_ratio, media_ratio=args.media_ratio, photo_ratio=args.photo_ratio,
+        media_size=args.media_size_kb * 1024, senders=args.senders, seed=args.seed)
+    media_size = sum(m.file.size for m in messages if m.photo or m.document)
+    print(f'Generated {len(messages)} messages with {media_size / 1024 / 1024:.1f} MB of media in {time.perf_counter() - started:.2f}s')
+
+    client = FakeTelegramClient(
+        messages, forum_topics, latency=args.latency_ms / 1000,
+        bandwidth=args.bandwidth_mbps * 1024 * 1024 or None, page_size=args.page_size,
+        flood_every=args.flood_every, flood_wait=args.flood_wait)
+    # Requests go through the bot's flood controller, which takes over FloodWaits from telethon
+    client.flood_control = bot.flood_control
+    client.flood_sleep_threshold = 0
+    bot.client = client
+    server, drive_state = start_server(latency=args.drive_latency_ms / 1000, fail_every=args.drive_fail_every)
+    setup_drive(upload, server)
+
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+    try:
+        results = asyncio.run(run(args, bot, upload, client, drive_state, selected))
+    finally:
+        server.shutdown()
+        if not args.keep:
+            os.chdir(BENCH_DIR)
+            shutil.rmtree(work_dir, ignore_errors=True)
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+    if args.keep:
+        print(f'Working directory kept at {work_dir}')
+
+
+if __name__ == '__main__':
+    main()
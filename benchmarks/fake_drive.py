@@ -0,0 +1,99 @@
+"""
+Local HTTP server that speaks enough of the Google Drive resumable upload protocol for
+gdrive/upload.py: POST opens a session, PUT uploads a chunk (308 + Range until the last
+byte arrives, then 200 with the file id). Only byte counts are kept, so large uploads
+do not show up in the benchmark's memory figures.
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_RANGE = re.compile(r'bytes (?:\*|(\d+)-(\d+))/(\d+|\*)')
+
+
+class DriveState:
+    def __init__(self, latency=0.0, fail_every=0):
+        self.latency = latency
+        # Answer every fail_every-th chunk with 503 to exercise the retry path
+        self.fail_every = fail_every
+        # session id -> bytes received
+        self.sessions = {}
+        # file id -> size
+        self.files = {}
+        self.chunks = 0
+        self.failures = 0
+        self.request_times = []
+        self.lock = threading.Lock()
+
+
+def make_handler(state):
+    class DriveHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, code, body=b'', headers=None):
+            self.send_response(code)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_body(self):
+            remaining = int(self.headers.get('Content-Length', 0))
+            size = remaining
+            while remaining:
+                remaining -= len(self.rfile.read(min(remaining, 1024 * 1024)))
+            return size
+
+        def do_POST(self):
+            started = time.perf_counter()
+            self._read_body()
+            session_id = uuid.uuid4().hex
+            with state.lock:
+                state.sessions[session_id] = 0
+            time.sleep(state.latency)
+            self._send(200, headers={'Location': f'http://{self.headers["Host"]}/upload/session/{session_id}'})
+            state.request_times.append(time.perf_counter() - started)
+
+        def do_PUT(self):
+            started = time.perf_counter()
+            session_id = self.path.rsplit('/', 1)[-1]
+            match = CONTENT_RANGE.match(self.headers.get('Content-Range', ''))
+            size = self._read_body()
+            time.sleep(state.latency)
+            with state.lock:
+                if session_id not in state.sessions:
+                    return self._send(404)
+                if match.group(1) is not None:
+                    state.chunks += 1
+                    if state.fail_every and state.chunks % state.fail_every == 0:
+                        state.failures += 1
+                        return self._send(503)
+                    state.sessions[session_id] = int(match.group(1)) + size
+                received = state.sessions[session_id]
+                total = match.group(3)
+                if total != '*' and received == int(total):
+                    file_id = uuid.uuid4().hex
+                    state.files[file_id] = received
+                    del state.sessions[session_id]
+                    body = json.dumps({'id': file_id}).encode()
+                    self._send(200, body, {'Content-Type': 'application/json'})
+                else:
+                    self._send(308, headers={'Range': f'bytes=0-{received - 1}'} if received else None)
+            state.request_times.append(time.perf_counter() - started)
+
+    return DriveHandler
+
+
+def start_server(latency=0.0, fail_every=0):
+    """Start the server on a free local port in a daemon thread. Returns (server, state)."""
+    state = DriveState(latency=latency, fail_every=fail_every)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
@@ -0,0 +1,177 @@
+"""
+Stand-in for telethon's TelegramClient used by the benchmarks.
+Messages are real telethon Message objects generated from a seed. Every request
+sleeps for a simulated round trip, and a FloodWait can be injected every N requests.
+"""
+import asyncio
+import datetime
+import os
+import random
+import time
+from collections import defaultdict
+from telethon.errors import FloodWaitError
+from telethon.tl import types
+from telethon.tl.functions.channels import GetForumTopicsRequest
+from telethon.tl.patched import Message, MessageService
+
+WORDS = ('backup', 'archive', 'photo', 'report', 'meeting', 'draft', 'update', 'invoice', 'notes', 'release', 'today', 'please', 'check', 'thanks', 'link')
+# Bytes per download request, like telethon's default part size for large files
+DOWNLOAD_PART_SIZE = 512 * 1024
+# Random block repeated to fill media files; larger than the deflate window so it stays incompressible
+_FILL_BLOCK = os.urandom(1024 * 1024)
+
+
+def generate_messages(count, topics=5, forum=True, reply_depth=3, reply_ratio=0.5, media_ratio=0.3, photo_ratio=0.5, media_size=256 * 1024, senders=50, url_ratio=0.1, seed=0):
+    """
+    Build a synthetic group history, newest first.
+    The first messages create the topics. Each later message joins a random topic and,
+    with reply_ratio, replies to an earlier message of that topic up to reply_depth deep.
+    With forum=False the reply headers carry no topic ids, so topics can only be found
+    by walking reply chains. Media sizes vary by +-50% around media_size.
+    Returns (messages, forum_topics).
+    """
+    rng = random.Random(seed)
+    peer = types.PeerChannel(1)
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    messages = []
+    forum_topics = []
+    # topic root id -> [(message id, depth)] of messages that can be replied to
+    threads = {}
+    for topic_id in range(1, topics + 1):
+        title = f'Topic {topic_id}'
+        messages.append(MessageService(id=topic_id, peer_id=peer, date=start, action=types.MessageActionTopicCreate(title=title, icon_color=0), from_id=types.PeerUser(1)))
+        forum_topics.append(types.ForumTopic(id=topic_id, date=start, title=title, icon_color=0, top_message=topic_id, read_inbox_max_id=0, read_outbox_max_id=0, unread_count=0, unread_mentions_count=0, unread_reactions_count=0, from_id=types.PeerUser(1), notify_settings=types.PeerNotifySettings()))
+        threads[topic_id] = [(topic_id, 0)]
+    for msg_id in range(topics + 1, count + 1):
+        reply_to = None
+        depth = 0
+        if threads:
+            topic_id = rng.choice(list(threads))
+            thread = threads[topic_id]
+            parent_id, parent_depth = thread[0]
+            if rng.random() < reply_ratio:
+                parent_id, parent_depth = rng.choice(thread[-50:])
+                if parent_depth >= reply_depth:
+                    parent_id, parent_depth = thread[0]
+            depth = parent_depth + 1
+            if forum:
+                reply_to = types.MessageReplyHeader(reply_to_msg_id=parent_id, reply_to_top_id=topic_id if parent_id != topic_id else None, forum_topic=True)
+            else:
+                reply_to = types.MessageReplyHeader(reply_to_msg_id=parent_id)
+            thread.append((msg_id, depth))
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 30)))
+        if rng.random() < url_ratio:
+            text += f' https://example.com/{msg_id}'
+        media = None
+        if rng.random() < media_ratio:
+            size = max(1, int(media_size * rng.uniform(0.5, 1.5)))
+            if rng.random() < photo_ratio:
+                photo = types.Photo(id=msg_id, access_hash=msg_id, file_reference=b'', date=start, sizes=[types.PhotoSize('y', 1280, 960, size)], dc_id=2)
+                media = types.MessageMediaPhoto(photo=photo)
+            else:
+                document = types.Document(id=msg_id, access_hash=msg_id, file_reference=b'', date=start, mime_type='application/octet-stream', size=size, dc_id=2, attributes=[types.DocumentAttributeFilename(f'file_{msg_id % 500}.bin')])
+                media = types.MessageMediaDocument(document=document)
+        messages.append(Message(id=msg_id, peer_id=peer, date=start + datetime.timedelta(seconds=msg_id), message=text, from_id=types.PeerUser(rng.randint(1, senders)), reply_to=reply_to, media=media))
+    messages.reverse()
+    return messages, forum_topics if forum else []
+
+
+class FakeTelegramClient:
+    """
+    Serves generated messages through the subset of the TelegramClient API the bot uses.
+    latency is the simulated round trip per request in seconds and bandwidth (bytes per
+    second, None = unlimited) limits media downloads. Every flood_every-th request first
+    hits a FloodWait of flood_wait seconds: like telethon, waits up to
+    flood_sleep_threshold are slept through and longer ones raise FloodWaitError.
+    With flood_control set, every request goes through it like in ThrottledTelegramClient.
+    """
+
+    parse_mode = None
+
+    def __init__(self, messages, forum_topics=(), latency=0.02, bandwidth=None, page_size=100, flood_every=0, flood_wait=1, flood_sleep_threshold=60):
+        self.messages = messages
+        self.forum_topics = list(forum_topics)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.page_size = page_size
+        self.flood_every = flood_every
+        self.flood_wait = flood_wait
+        self.flood_sleep_threshold = flood_sleep_threshold
+        self.flood_control = None
+        self.requests = 0
+        self.flood_waits = 0
+        # Request kind -> durations in seconds
+        self.calls = defaultdict(list)
+        self._by_id = {m.id: m for m in messages}
+        for message in messages:
+            # Lets Message.text work without a connected client
+            message._client = self
+
+    async def _request(self, kind, payload_size=0):
+        if self.flood_control:
+            return await self.flood_control.call(self._send_request, kind, payload_size)
+        return await self._send_request(kind, payload_size)
+
+    async def _send_request(self, kind, payload_size):
+        started = time.perf_counter()
+        self.requests += 1
+        if self.flood_every and self.requests % self.flood_every == 0:
+            self.flood_waits += 1
+            if self.flood_wait > self.flood_sleep_threshold:
+                raise FloodWaitError(request=None, capture=self.flood_wait)
+            await asyncio.sleep(self.flood_wait)
+        delay = self.latency
+        if self.bandwidth and payload_size:
+            delay += payload_size / self.bandwidth
+        await asyncio.sleep(delay)
+        self.calls[kind].append(time.perf_counter() - started)
+
+    async def iter_messages(self, entity, limit=None, min_id=0, max_id=0, **kwargs):
+        selected = [m for m in self.messages if m.id > (min_id or 0) and (not max_id or m.id < max_id)]
+        if limit is not None:
+            selected = selected[:limit]
+        for i in range(0, len(selected), self.page_size):
+            await self._request('get_history')
+            for message in selected[i:i + self.page_size]:
+                yield message
+
+    async def get_messages(self, entity, ids=None, **kwargs):
+        await self._request('get_messages')
+        if isinstance(ids, int):
+            return self._by_id.get(ids)
+        return [self._by_id.get(i) for i in ids]
+
+    async def get_input_entity(self, peer):
+        # Every sender is in the session cache, so no request is made
+        return types.InputPeerUser(peer, 0)
+
+    async def get_entity(self, entity):
+        await self._request('get_users')
+        ids = [getattr(peer, 'user_id', peer) for peer in (entity if isinstance(entity, list) else [entity])]
+        users = [types.User(id=user_id, first_name=f'User {user_id}') for user_id in ids]
+        return users if isinstance(entity, list) else users[0]
+
+    async def download_media(self, message, file=None, progress_callback=None, thumb=None):
+        size = message.file.size
+        if not os.path.splitext(file)[1]:
+            file += message.file.ext or ''
+        written = 0
+        with open(file, 'wb') as f:
+            while written < size:
+                part = min(DOWNLOAD_PART_SIZE, size - written)
+                await self._request('get_file', part)
+                offset = written % (len(_FILL_BLOCK) - DOWNLOAD_PART_SIZE)
+                f.write(_FILL_BLOCK[offset:offset + part])
+                written += part
+                if progress_callback:
+                    progress_callback(written, size)
+        return file
+
+    async def __call__(self, request):
+        if isinstance(request, GetForumTopicsRequest):
+            await self._request('get_forum_topics')
+            start = 0
+            if request.offset_topic:
+                start = next((i + 1 for i, t in enumerate(self.forum_topics) if t.id == request.offset_topic), len(self.forum_topics))
+            return types.messages.ForumTopics(count=len(self.forum_topics), topics=self.forum_topics[start:start + request.limit], messages=[], chats=[], users=[], pts=0)
+        raise NotImplementedError(f'{type(request).__name__} is not simulated')
@@ -6,21 +6,57 @@ Setup:
 1. Go to https://console.developers.google.com/apis/credentials and create OAuth client ID credentials for Desktop app.
 2. Download credentials.json and place it in the same directory as this script.
 3. The first run will prompt for Google account authorization and save token.json for future use.
+
+The Google client libraries are imported on first use, so importing this module is cheap
+and nothing from the Drive stack is loaded while Drive upload is disabled.
 """
 import os
-import socket
+import json
+import time
+import random
 import pickle
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.colorlog import logger
 
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CREDENTIALS_FILE = os.path.abspath(os.path.join(BASE_DIR, '..', '..', 'config', 'credentials.json'))
 TOKEN_FILE = os.path.abspath(os.path.join(os.getcwd(), 'gdrive_token.pickle'))
+# Resumable upload sessions, kept next to the token so interrupted uploads survive restarts
+SESSIONS_FILE = os.path.abspath(os.path.join(os.path.dirname(TOKEN_FILE), 'gdrive_upload_sessions.json'))
 
-def get_drive_service():
+# Resumable uploads need chunk sizes that are multiples of 256 KB
+CHUNK_ALIGNMENT = 256 * 1024
+DEFAULT_CHUNK_SIZE = 5 * 1024 * 1024
+MAX_CHUNK_SIZE = 256 * 1024 * 1024
+# Adaptive mode grows the chunk size while a chunk takes less than this many seconds
+TARGET_CHUNK_SECONDS = 4
+UPLOAD_WORKERS = 2
+# Retries of a failed chunk before giving up, with exponential backoff capped at MAX_BACKOFF seconds
+MAX_RETRIES = 8
+MAX_BACKOFF = 64
+# Status codes worth retrying; anything else fails the upload
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# Built once and shared for the life of the process
+_creds = None
+_service = None
+_service_lock = threading.Lock()
+# httplib2 connections are not thread-safe, so each upload thread keeps its own transport
+_thread_local = threading.local()
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='gdrive-upload')
+_sessions_lock = threading.Lock()
+
+def _save_credentials(creds):
+	with open(TOKEN_FILE, 'wb') as token:
+		pickle.dump(creds, token)
+
+def _load_credentials():
+	from google.auth.transport.requests import Request
+	from google_auth_oauthlib.flow import InstalledAppFlow
 	creds = None
 	if os.path.exists(TOKEN_FILE):
 		with open(TOKEN_FILE, 'rb') as token:
@@ -31,13 +67,97 @@ def get_drive_service():
 		else:
 			flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
 			creds = flow.run_local_server(port=0)
-		with open(TOKEN_FILE, 'wb') as token:
-			pickle.dump(creds, token)
-	return build('drive', 'v3', credentials=creds)
+		_save_credentials(creds)
+	return creds
+
+def get_drive_service():
+	"""
+	Return the shared Drive service, building it on first use and refreshing expired credentials.
+	The service is built from the discovery document bundled with google-api-python-client,
+	so no request is made to fetch it and no discovery cache is written.
+	"""
+	global _creds, _service
+	with _service_lock:
+		if _service is None:
+			from googleapiclient.discovery import build
+			_creds = _load_credentials()
+			_service = build('drive', 'v3', credentials=_creds, static_discovery=True, cache_discovery=False)
+		elif not _creds.valid and _creds.refresh_token:
+			from google.auth.transport.requests import Request
+			_creds.refresh(Request())
+			_save_credentials(_creds)
+		return _service
+
+def get_drive_http():
+	"""Return this thread's authorized HTTP transport, creating it on first use."""
+	http = getattr(_thread_local, 'http', None)
+	if http is None:
+		import httplib2
+		from google_auth_httplib2 import AuthorizedHttp
+		get_drive_service()
+		transport = httplib2.Http(timeout=None)
+		# Drive answers unfinished resumable chunks with 308, which is not a redirect here
+		transport.redirect_codes = transport.redirect_codes - {308}
+		http = AuthorizedHttp(_creds, http=transport)
+		_thread_local.http = http
+	return http
+
+def _session_key(filepath):
+	return f'{os.path.abspath(filepath)}:{os.path.getsize(filepath)}'
+
+def _read_sessions():
+	if not os.path.exists(SESSIONS_FILE):
+		return {}
+	try:
+		with open(SESSIONS_FILE, 'r') as f:
+			return json.load(f)
+	except Exception:
+		return {}
 
-def upload_file_to_gdrive(filepath, folder_id=None):
-	"""Upload a file to Google Drive. Optionally specify a folder_id."""
+def _write_sessions(sessions):
+	tmp_path = SESSIONS_FILE + '.tmp'
+	with open(tmp_path, 'w') as f:
+		json.dump(sessions, f)
+	os.replace(tmp_path, SESSIONS_FILE)
+
+def get_upload_session(key):
+	"""Return the saved {'uri', 'progress'} for an upload, or None."""
+	with _sessions_lock:
+		return _read_sessions().get(key)
+
+def save_upload_session(key, uri, progress):
+	with _sessions_lock:
+		sessions = _read_sessions()
+		sessions[key] = {'uri': uri, 'progress': progress}
+		_write_sessions(sessions)
+
+def forget_upload_session(key):
+	with _sessions_lock:
+		sessions = _read_sessions()
+		if sessions.pop(key, None) is not None:
+			_write_sessions(sessions)
+
+def _backoff(attempt):
+	return min(MAX_BACKOFF, 2 ** attempt) + random.random()
+
+def _align_chunk_size(chunk_size):
+	return max(CHUNK_ALIGNMENT, min(MAX_CHUNK_SIZE, chunk_size // CHUNK_ALIGNMENT * CHUNK_ALIGNMENT))
+
+def upload_file_to_gdrive(filepath, folder_id=None, chunk_size=DEFAULT_CHUNK_SIZE, adaptive_chunk_size=False, on_retry=None, progress_callback=None):
+	"""
+	Upload a file to Google Drive. Optionally specify a folder_id.
+	on_retry is called with a short reason each time a chunk is retried or the session restarts.
+	progress_callback(current, total) replaces the printed progress bar, e.g. to feed a shared tracker.
+	With adaptive_chunk_size the chunk size doubles while chunks finish quickly, so fast
+	links are not held back by one round trip per small chunk.
+	The resumable session is saved after every chunk; after a failure or a restart the
+	upload continues from the last byte Drive acknowledged.
+	"""
+	import httplib2
+	from googleapiclient.errors import HttpError
+	from googleapiclient.http import MediaFileUpload
 	service = get_drive_service()
+	http = get_drive_http()
 	file_metadata = {'name': os.path.basename(filepath)}
 	if folder_id:
 		file_metadata['parents'] = [folder_id]
@@ -56,20 +176,72 @@ def upload_file_to_gdrive(filepath, folder_id=None):
 		if current == total:
 			print()  # Newline after complete
 
-	# Set chunk size to 5MB
-	chunk_size = 5 * 1024 * 1024
-	media = MediaFileUpload(filepath, resumable=True, chunksize=chunk_size)
-	# Set unlimited timeout for upload
-	orig_socket_timeout = socket.getdefaulttimeout()
-	socket.setdefaulttimeout(None)
-	try:
+	progress_callback = progress_callback or progress_bar
+	media = MediaFileUpload(filepath, resumable=True, chunksize=_align_chunk_size(chunk_size))
+	session_key = _session_key(filepath)
+
+	def new_request():
 		request = service.files().create(body=file_metadata, media_body=media, fields='id')
-		response = None
-		while response is None:
-			status, response = request.next_chunk()
-			if status:
-				progress_bar(status.resumable_progress, media.size())
-		progress_bar(media.size(), media.size())
-	finally:
-		socket.setdefaulttimeout(orig_socket_timeout)
+		saved = get_upload_session(session_key)
+		if saved:
+			logger.info(f'Resuming Google Drive upload of {filepath} from byte {saved["progress"]}')
+			request.resumable_uri = saved['uri']
+			request.resumable_progress = saved['progress']
+			# Makes the next chunk ask Drive for the last acknowledged byte first
+			request._in_error_state = True
+		return request
+
+	# The transport has no socket timeout, so large chunks are never cut off
+	request = new_request()
+	response = None
+	attempt = 0
+	while response is None:
+		started = time.monotonic()
+		try:
+			status, response = request.next_chunk(http=http)
+		except HttpError as e:
+			if e.resp.status in (404, 410):
+				# The session expired on Drive's side; start a fresh one. Restarts count as retries,
+				# so a 404 that is not about the session (e.g. a bad folder_id) cannot loop forever
+				if attempt >= MAX_RETRIES:
+					raise
+				attempt += 1
+				logger.warning(f'Google Drive upload session for {filepath} expired, restarting upload ({attempt}/{MAX_RETRIES})')
+				forget_upload_session(session_key)
+				request = new_request()
+				if on_retry:
+					on_retry('session_expired')
+				time.sleep(_backoff(attempt))
+				continue
+			if e.resp.status not in RETRYABLE_STATUSES or attempt >= MAX_RETRIES:
+				raise
+			attempt += 1
+			logger.warning(f'Google Drive chunk failed ({e.resp.status}), retry {attempt}/{MAX_RETRIES}')
+			if on_retry:
+				on_retry(f'http_{e.resp.status}')
+			time.sleep(_backoff(attempt))
+			continue
+		except (OSError, httplib2.HttpLib2Error) as e:
+			if attempt >= MAX_RETRIES:
+				raise
+			attempt += 1
+			logger.warning(f'Google Drive connection error ({e}), retry {attempt}/{MAX_RETRIES}')
+			if on_retry:
+				on_retry('connection_error')
+			time.sleep(_backoff(attempt))
+			continue
+		attempt = 0
+		if status:
+			save_upload_session(session_key, request.resumable_uri, status.resumable_progress)
+			progress_callback(status.resumable_progress, media.size())
+		if adaptive_chunk_size and time.monotonic() - started < TARGET_CHUNK_SECONDS:
+			media._chunksize = _align_chunk_size(media._chunksize * 2)
+	forget_upload_session(session_key)
+	progress_callback(media.size(), media.size())
 	return response.get('id')
+
+async def upload_file_to_gdrive_async(filepath, folder_id=None, chunk_size=DEFAULT_CHUNK_SIZE, adaptive_chunk_size=False, on_retry=None, progress_callback=None):
+	"""Run upload_file_to_gdrive on the upload thread pool without blocking the event loop."""
+	loop = asyncio.get_running_loop()
+	upload = functools.partial(upload_file_to_gdrive, filepath, folder_id=folder_id, chunk_size=chunk_size, adaptive_chunk_size=adaptive_chunk_size, on_retry=on_retry, progress_callback=progress_callback)
+	return await loop.run_in_executor(_executor, upload)
@@ -1,478 +1,849 @@
+import asyncio
 import random
 import string
 import datetime
-import glob
 import os
-import pyzipper
-import time
 import re
+import json
+import shutil
 import logging
 import configparser
 from utils.colorlog import logger
+from utils.archive import VolumeSet
+from utils.sender_cache import SenderCache
+from utils.topics import TopicResolver, fetch_forum_topics
+from utils.media_manifest import MediaManifest
+from utils.media_policy import FULL, SKIP, THUMB, MediaPolicy, format_size, select_thumbnail
+from utils.media_cache import MediaCache, get_media_key
+from utils.message_index import MessageIndex
+from utils.journal import BackupJournal
+from utils.scheduler import JobScheduler
+from utils.fair_share import FairShare
+from utils.metrics import JobMetrics, MetricsRegistry, serve_prometheus, watch_telethon
+from utils.progress import ProgressTracker
+from utils.chat_log import write_chat_log
+from utils.archive_manifest import DELTA, FULL as FULL_ARCHIVE, archive_stem, file_sha256, write_archive_manifest
+from utils.flood_control import AdaptiveConcurrency, ThrottledTelegramClient
+from utils.takeout import SharedTakeout
+from utils.fast_upload import BIG_FILE_MIN_SIZE, upload_file_parallel
 from collections import defaultdict
-from telethon import TelegramClient, events
-from telethon.tl.functions.channels import GetForumTopicsRequest
-from telethon.tl.types import ForumTopic
-from gdrive.upload import upload_file_to_gdrive
+from contextlib import asynccontextmanager
+from telethon import events
+from gdrive.upload import upload_file_to_gdrive_async
 
-config_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config', 'config.ini'))
+# AUTOCLOUD_CONFIG points at another config file, e.g. the one used by the benchmarks
+config_path = os.environ.get('AUTOCLOUD_CONFIG') or os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config', 'config.ini'))
 parser = configparser.ConfigParser()
 parser.read(config_path)
 
 DEFAULT_PASSWORD = parser.get('general', 'DEFAULT_PASSWORD')
 SEND_TO_TELEGRAM = parser.getboolean('general', 'SEND_TO_TELEGRAM', fallback=False)
 DELETE_FILES_AFTER_UPLOAD = parser.getboolean('general', 'DELETE_FILES_AFTER_UPLOAD', fallback=True)
+DOWNLOAD_WORKERS = max(1, parser.getint('general', 'DOWNLOAD_WORKERS', fallback=4))
+MAX_PARALLEL_BACKUPS = max(1, parser.getint('general', 'MAX_PARALLEL_BACKUPS', fallback=2))
+MAX_PARALLEL_DELIVERIES = max(1, parser.getint('general', 'MAX_PARALLEL_DELIVERIES', fallback=2))
+DELIVERY_ATTEMPTS = max(1, parser.getint('general', 'DELIVERY_ATTEMPTS', fallback=3))
+COMPRESSION_LEVEL = parser.getint('general', 'COMPRESSION_LEVEL', fallback=9)
+VOLUME_SIZE_MB = parser.getint('general', 'VOLUME_SIZE_MB', fallback=0)
+ARCHIVE_WORKERS = max(1, parser.getint('general', 'ARCHIVE_WORKERS', fallback=2))
+SENDER_CACHE_SIZE = parser.getint('general', 'SENDER_CACHE_SIZE', fallback=5000)
+CHAT_LOG_PAGE_SIZE = max(1, parser.getint('general', 'CHAT_LOG_PAGE_SIZE', fallback=1000))
+MEDIA_CACHE_SIZE_MB = parser.getint('general', 'MEDIA_CACHE_SIZE_MB', fallback=0)
+MESSAGE_INDEX = parser.getboolean('general', 'MESSAGE_INDEX', fallback=True)
+SYNC_INTERVAL_MINUTES = parser.getint('general', 'SYNC_INTERVAL_MINUTES', fallback=0)
+PROGRESS_INTERVAL = parser.getfloat('general', 'PROGRESS_INTERVAL', fallback=2)
+STATUS_MESSAGE = parser.getboolean('general', 'STATUS_MESSAGE', fallback=False)
+STATUS_MESSAGE_INTERVAL = parser.getfloat('general', 'STATUS_MESSAGE_INTERVAL', fallback=10)
 
 API_ID = parser.get('telegram', 'API_ID')
 API_HASH = parser.get('telegram', 'API_HASH')
 PHONE = parser.get('telegram', 'PHONE')
-GROUP_ID = parser.getint('telegram', 'GROUP_ID')
+# One or more groups separated by commas; GROUP_IDS is accepted as well
+GROUP_IDS = [int(group_id) for group_id in parser.get('telegram', 'GROUP_IDS', fallback=parser.get('telegram', 'GROUP_ID', fallback='')).split(',') if group_id.strip()]
 ADMIN_ID = parser.getint('telegram', 'ADMIN_ID')
+PARALLEL_UPLOAD_CONNECTIONS = parser.getint('telegram', 'PARALLEL_UPLOAD_CONNECTIONS', fallback=4)
+PARALLEL_UPLOAD_MIN_SIZE_MB = parser.getint('telegram', 'PARALLEL_UPLOAD_MIN_SIZE_MB', fallback=20)
+MAX_CONCURRENT_REQUESTS = max(1, parser.getint('telegram', 'MAX_CONCURRENT_REQUESTS', fallback=8))
+MAX_FLOOD_WAIT = parser.getint('telegram', 'MAX_FLOOD_WAIT', fallback=3600)
+TAKEOUT = parser.getboolean('telegram', 'TAKEOUT', fallback=False)
+# Largest file a takeout session is asked to allow downloading
+TAKEOUT_MAX_FILE_SIZE = 4000 * 1024 * 1024
+
+# Media downloads of /backup_now; /backup_sync reads [sync_media] and falls back to [media]
+MEDIA_POLICY = MediaPolicy.from_config(parser, 'media')
+SYNC_MEDIA_POLICY = MediaPolicy.from_config(parser, 'sync_media', base_section='media')
+
+GDRIVE_ENABLED = parser.getboolean('gdrive', 'ENABLED', fallback=True)
+GDRIVE_CHUNK_SIZE_MB = parser.getint('gdrive', 'CHUNK_SIZE_MB', fallback=5)
+GDRIVE_ADAPTIVE_CHUNK_SIZE = parser.getboolean('gdrive', 'ADAPTIVE_CHUNK_SIZE', fallback=True)
+
+PROMETHEUS_PORT = parser.getint('metrics', 'PROMETHEUS_PORT', fallback=0)
+PROMETHEUS_HOST = parser.get('metrics', 'PROMETHEUS_HOST', fallback='127.0.0.1')
 
 COLLECTED_FILES_DIR = 'data'
-MEDIA_SUBFOLDER = os.path.join(COLLECTED_FILES_DIR, 'media')
-LAST_BACKUP_FILE = os.path.join(COLLECTED_FILES_DIR, 'last_backup_id.txt')
+# Each backup job stages its chat log, media, archives and journal in its own directory here
+JOBS_DIR = os.path.join(COLLECTED_FILES_DIR, 'jobs')
+JOURNAL_NAME = 'journal.jsonl'
+# Workspaces are renamed to this suffix before they are deleted
+REMOVED_SUFFIX = '.removed'
+# Destinations of finished archives, as named in the job journal
+TELEGRAM_DESTINATION = 'telegram'
+GDRIVE_DESTINATION = 'gdrive'
+# group id -> newest message id and archive name of the last backup, as JSON
+LAST_BACKUP_FILE = os.path.join(COLLECTED_FILES_DIR, 'last_backup_ids.json')
+# Single-group watermark from before several groups were supported; read for the first group
+LEGACY_LAST_BACKUP_FILE = os.path.join(COLLECTED_FILES_DIR, 'last_backup_id.txt')
+SENDER_CACHE_FILE = os.path.join(COLLECTED_FILES_DIR, 'sender_cache.json')
+MEDIA_CACHE_DIR = os.path.join(COLLECTED_FILES_DIR, 'media_cache')
+MESSAGE_INDEX_FILE = os.path.join(COLLECTED_FILES_DIR, 'messages.sqlite')
+# One JSON summary of timings and counters per finished job
+METRICS_DIR = os.path.join(COLLECTED_FILES_DIR, 'metrics')
 
 os.makedirs(COLLECTED_FILES_DIR, exist_ok=True)
-os.makedirs(MEDIA_SUBFOLDER, exist_ok=True)
+os.makedirs(JOBS_DIR, exist_ok=True)
+
+metrics_registry = MetricsRegistry()
+watch_telethon(metrics_registry)
+
+def count_flood_wait(seconds):
+    metrics_registry.count('telegram_flood_waits')
+    metrics_registry.count('telegram_flood_wait_seconds', seconds)
 
-client = TelegramClient('cloud_archive', API_ID, API_HASH)
+# Every Telegram request goes through this; it starts at DOWNLOAD_WORKERS requests in flight and
+# adapts between 1 and MAX_CONCURRENT_REQUESTS, which gates how many downloads actually run
+flood_control = AdaptiveConcurrency(initial=DOWNLOAD_WORKERS, maximum=MAX_CONCURRENT_REQUESTS, max_wait=MAX_FLOOD_WAIT, on_flood_wait=count_flood_wait)
+client = ThrottledTelegramClient('cloud_archive', API_ID, API_HASH, flood_control=flood_control)
+takeout = SharedTakeout(client, megagroups=True, channels=True, files=True, max_file_size=TAKEOUT_MAX_FILE_SIZE)
 
+sender_cache = SenderCache(SENDER_CACHE_FILE, max_size=SENDER_CACHE_SIZE)
+media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_SIZE_MB * 1024 * 1024) if MEDIA_CACHE_SIZE_MB > 0 else None
+message_index = MessageIndex(MESSAGE_INDEX_FILE) if MESSAGE_INDEX else None
+# Runs /backup_now and /backup_sync jobs of up to MAX_PARALLEL_BACKUPS groups at once, one job per group at a time
+scheduler = JobScheduler(concurrency=MAX_PARALLEL_BACKUPS)
+# Download and delivery slots shared by all running jobs, split evenly between their groups
+download_slots = FairShare(MAX_CONCURRENT_REQUESTS)
+delivery_slots = FairShare(MAX_PARALLEL_DELIVERIES)
+# Messages written to the index (and refetched for media) per request
+INDEX_BATCH_SIZE = 100
+# Downloads in flight keyed by media identity, so a file posted twice is fetched once
+_media_downloads = {}
+# group id -> title, looked up once per run
+_group_titles = {}
 
-def get_last_backup_id():
-    """Read last backup message ID from file."""
+
+def read_last_backups():
+    """Message ID and archive name of every group's last backup, from file."""
     if os.path.exists(LAST_BACKUP_FILE):
         try:
             with open(LAST_BACKUP_FILE, 'r') as f:
+                return {int(group_id): last for group_id, last in json.load(f).items()}
+        except Exception:
+            return {}
+    return {}
+
+def get_last_backup_id(group_id):
+    """Read last backup message ID of a group from file."""
+    last = read_last_backups().get(group_id)
+    if last:
+        return last['message_id']
+    if group_id == GROUP_IDS[0] and os.path.exists(LEGACY_LAST_BACKUP_FILE):
+        try:
+            with open(LEGACY_LAST_BACKUP_FILE, 'r') as f:
                 return int(f.read().strip())
         except Exception:
             return None
     return None
 
-def set_last_backup_id(msg_id):
-    """Write last backup message ID to file."""
+def get_last_archive(group_id):
+    """Name of the group's last archive, which the next delta archive points back to."""
+    last = read_last_backups().get(group_id)
+    return last.get('archive') if last else None
+
+def set_last_backup_id(group_id, msg_id, archive=None):
+    """Write last backup message ID and archive name of a group to file."""
+    last_backups = read_last_backups()
+    last_backups[group_id] = {'message_id': msg_id, 'archive': archive}
     try:
         with open(LAST_BACKUP_FILE, 'w') as f:
-            f.write(str(msg_id))
+            json.dump({str(key): value for key, value in last_backups.items()}, f)
     except Exception:
         logger.error('Failed to write last backup ID.')
         pass
 
-async def generate_topic_grouped_chat_log(messages, chat_log_path, title="Telegram Archive Backup"):
+async def generate_topic_grouped_chat_log(group_id, messages, output_dir, title="Telegram Archive Backup", manifest=None, archive_name=None, archive_kind=FULL_ARCHIVE, previous_archive=None):
     """
-    Generate an HTML chat log grouped by topic, with collapsible sections.
+    Render the HTML chat log into output_dir: a small index page with a collapsible
+    section per topic, and each topic's messages in pages of CHAT_LOG_PAGE_SIZE that
+    the index loads on demand. Media links use the archive names recorded in the manifest.
+    With archive_name the archive manifest and message rows that restore.py merges
+    archives from are written as well, pointing back to previous_archive.
+    Returns (path, arcname) for every file written.
     """
-    html_header = f'''<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <title>{title}</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;600&display=swap" rel="stylesheet">
-    <style>
-        body {{
-            font-family: 'Inter', Arial, sans-serif;
-            background: linear-gradient(120deg, #e0e7ff 0%, #f5f7fa 100%);
-            margin: 0;
-            margin-inline: 12px;
-            padding: 0;
-            min-height: 100vh;
-        }}
-        .chat-container {{
-            max-width: 900px;
-            margin: 48px auto;
-            background: #fff;
-            border-radius: 18px;
-            box-shadow: 0 6px 32px rgba(60,72,88,0.13);
-            padding: 36px 32px 32px 32px;
-            overflow: hidden;
-        }}
-        h2 {{
-            text-align: center;
-            font-weight: 600;
-            color: #2a5885;
-            margin-bottom: 32px;
-            letter-spacing: 1px;
-        }}
-        .chat-log {{
-            margin-top: 0;
-        }}
-        .topic-section {{
-            margin-top: 40px;
-            border-radius: 12px;
-            background: #f7faff;
-            box-shadow: 0 1px 4px rgba(60,72,88,0.07);
-            padding: 0 0 12px 0;
-        }}
-        .topic-header {{
-            display: flex;
-            align-items: center;
-            justify-content: space-between;
-            background: #e3eaff;
-            border-radius: 12px 12px 0 0;
-            padding: 16px 24px;
-            cursor: pointer;
-            font-size: 1.15em;
-            font-weight: 600;
-            color: #2a5885;
-            transition: background 0.2s;
-        }}
-        .topic-header:hover {{
-            background: #d0e2ff;
-        }}
-        .topic-count {{
-            background: #2a5885;
-            color: #fff;
-            border-radius: 8px;
-            padding: 2px 10px;
-            font-size: 0.95em;
-            margin-left: 12px;
-        }}
-        .topic-content {{
-            display: none;
-            padding: 18px 24px 0 24px;
-        }}
-        .msg {{
-            margin-bottom: 28px;
-            padding-bottom: 12px;
-            border-bottom: 1px solid #e3eaff;
-            background: #fff;
-            border-radius: 8px;
-            box-shadow: 0 1px 2px rgba(60,72,88,0.04);
-            padding: 18px 18px 12px 18px;
-            transition: box-shadow 0.2s;
-        }}
-        .msg:last-child {{
-            border-bottom: none;
-        }}
-        .sender {{
-            font-weight: 600;
-            color: #2a5885;
-            font-size: 1.08em;
-        }}
-        .date {{
-            font-size: 0.93em;
-            color: #7a8599;
-            margin-left: 10px;
-        }}
-        .text {{
-            margin: 10px 0 0 0;
-            font-size: 1.07em;
-            color: #222b45;
-            line-height: 1.6;
-            word-break: break-word;
-        }}
-        .media {{
-            color: #d2691e;
-            font-style: italic;
-            margin-top: 10px;
-        }}
-        .media img {{
-            max-width: 340px;
-            max-height: 340px;
-            border-radius: 10px;
-            box-shadow: 0 2px 8px rgba(60,72,88,0.13);
-            margin: 10px 0;
-            display: block;
-        }}
-        .media a {{
-            color: #2a5885;
-            text-decoration: underline;
-            font-weight: 500;
-        }}
-        @media (max-width: 600px) {{
-            .chat-container {{ padding: 10px; }}
-            .topic-header, .topic-content {{ padding: 10px; }}
-            .msg {{ padding: 10px; }}
-        }}
-        .toggle-icon {{
-            font-size: 1.2em;
-            margin-left: 8px;
-            transition: transform 0.2s;
-        }}
-        .topic-header.open .toggle-icon {{
-            transform: rotate(90deg);
-        }}
-    </style>
-</head>
-<body>
-<div class="chat-container">
-<h2>{title}</h2>
-<div class="chat-log">
-'''
-    html_footer = '''</div></div></body></html>'''
-    collapsible_script = '''<script>
-function toggleTopic(id) {
-  var header = document.getElementById('header_' + id);
-  var content = document.getElementById(id);
-  if (content.style.display === "none" || content.style.display === "") {
-    content.style.display = "block";
-    header.classList.add('open');
-  } else {
-    content.style.display = "none";
-    header.classList.remove('open');
-  }
-}
-</script>'''
-    # Fetch topics
-    topic_map = {}
+    topic_map = await fetch_forum_topics(client, group_id)
+    sender_names = await sender_cache.resolve(client, messages)
     try:
-        topics_result = await client(GetForumTopicsRequest(GROUP_ID, offset_date=None, offset_id=0, offset_topic=0, limit=100))
-        for topic in getattr(topics_result, 'topics', []):
-            if isinstance(topic, ForumTopic):
-                topic_map[topic.id] = topic.title
-    except Exception:
-        topic_map = {}
-    # Collect messages by topic root message id and topic name
-    topic_root_map = {}
-    all_messages = []
-    for message in messages:
-        topic_name = getattr(getattr(message, 'action', None), 'title', None)
-        if topic_name:
-            topic_root_map[message.id] = topic_name
-        sender = await message.get_sender()
-        sender_name = sender.first_name if sender and hasattr(sender, 'first_name') else str(message.sender_id)
-        date_str = message.date.strftime('%Y-%m-%d %H:%M:%S')
-        all_messages.append((message, sender_name, date_str))
-    # Group messages by topic
-    topic_messages = {}
-    msg_id_map = {msg.id: msg for (msg, _, _) in all_messages}
-    for message, sender_name, date_str in all_messages:
-        current = message
-        topic_name = None
-        visited = set()
-        while current:
-            if current.id in topic_root_map:
-                topic_name = topic_root_map[current.id]
-                break
-            reply_to = getattr(current, 'reply_to', None)
-            reply_to_msg_id = getattr(reply_to, 'reply_to_msg_id', None) if reply_to else None
-            if reply_to_msg_id and reply_to_msg_id in msg_id_map and reply_to_msg_id not in visited:
-                visited.add(reply_to_msg_id)
-                current = msg_id_map[reply_to_msg_id]
-            else:
-                current = None
-        if not topic_name:
-            topic_name = 'General'
-        if topic_name not in topic_messages:
-            topic_messages[topic_name] = []
-        msg_dict = {
-            'sender_name': sender_name,
-            'date_str': date_str,
-            'text': message.text if message.text else None,
-            'photo': f"media/photo_{message.id}.jpg" if message.photo else None,
-            'document': f"media/{message.file.name}" if message.document and message.file and message.file.name else (f"media/document_{message.id}" if message.document else None)
-        }
-        topic_messages[topic_name].append(msg_dict)
-    grouped_msgs = defaultdict(list)
-    for topic_name, msgs in topic_messages.items():
-        for msg in msgs:
-            grouped_msgs[topic_name].append(msg)
-    with open(chat_log_path, 'w', encoding='utf-8') as f:
-        f.write(html_header)
-        f.write(collapsible_script)
-        topic_counter = 0
-        for topic_name, msgs in grouped_msgs.items():
-            topic_div_id = f"topic_{topic_counter}"
-            msg_count = len(msgs)
-            # Topic section with modern style
-            f.write(f'<div class="topic-section">')
-            f.write(f'<div class="topic-header" id="header_{topic_div_id}" onclick="toggleTopic(\'{topic_div_id}\')">')
-            f.write(f'<div>')
-            f.write(f'<span>{topic_name}</span>')
-            f.write(f'<span class="topic-count">{msg_count}</span>')
-            f.write(f'</div>')
-            f.write(f'<span class="toggle-icon">&#9654;</span>')
-            f.write(f'</div>')
-            f.write(f'<div class="topic-content" id="{topic_div_id}">')
-            for msg in msgs:
-                f.write('<div class="msg">')
-                f.write(f'<span class="sender">{msg["sender_name"]}</span>')
-                f.write(f'<span class="date">{msg["date_str"]}</span>')
-                if msg['text']:
-                    def make_links_clickable(text):
-                        url_pattern = r'(https?://\S+|www\.\S+)'  # Match http/https/www URLs
-                        return re.sub(url_pattern, lambda m: f'<a href="{m.group(0)}" target="_blank">{m.group(0)}</a>', text)
-                    safe_text = make_links_clickable(msg["text"]).replace('\n', '<br>')
-                    f.write(f'<div class="text">{safe_text}</div>')
-                if msg['photo']:
-                    img_src = msg["photo"]
-                    f.write(f'<div class="media"><img src="{img_src}" alt="Photo" /></div>')
-                if msg['document']:
-                    doc_url = msg["document"]
-                    doc_path = os.path.join(COLLECTED_FILES_DIR, doc_url)
-                    if not os.path.splitext(doc_url)[1]:
-                        matches = glob.glob(doc_path + '.*')
-                        if matches:
-                            doc_url = os.path.relpath(matches[0], COLLECTED_FILES_DIR)
-                    doc_name = os.path.basename(doc_url)
-                    f.write(f'<div class="media">[<a href="{doc_url}" target="_blank">{doc_name}</a>]</div>')
-                f.write('</div>')
-            f.write('</div></div>')
-            topic_counter += 1
-        f.write(html_footer)
-
-async def zip_files(messages, chat_log_path, zip_file_path, password):
+        sender_cache.save()
+    except Exception as e:
+        logger.error(f'Failed to save sender cache: {e}')
+    # Only message positions are grouped; the rows are built while each page is written
+    topic_resolver = TopicResolver(messages, topic_map)
+    topic_positions = defaultdict(list)
+    for position, message in enumerate(messages):
+        topic_positions[topic_resolver.resolve(message)].append(position)
+
+    def rows(positions):
+        for position in positions:
+            message = messages[position]
+            yield (
+                sender_names.get(message.sender_id, str(message.sender_id)),
+                message.date.strftime('%Y-%m-%d %H:%M:%S'),
+                message.text or None,
+                *get_media_links(message, manifest),
+            )
+
+    topics = [(topic_name, len(positions), rows(positions)) for topic_name, positions in topic_positions.items()]
+    files = await asyncio.to_thread(write_chat_log, output_dir, title, topics, CHAT_LOG_PAGE_SIZE)
+    if archive_name:
+        def manifest_rows():
+            for topic_name, positions in topic_positions.items():
+                for position, row in zip(positions, rows(positions)):
+                    yield (messages[position].id, topic_name, *row)
+
+        def write_manifest():
+            media = {}
+            for message in messages:
+                entry = manifest.get(message.id) if manifest else None
+                if entry:
+                    # Downloads hash their files; media from older journals is hashed here
+                    sha256 = entry.sha256 or (file_sha256(entry.path) if os.path.exists(entry.path) else None)
+                    media[entry.arcname] = (message.id, entry.size, sha256)
+            return write_archive_manifest(output_dir, archive_name, archive_kind, group_id, title, previous_archive, manifest_rows(), media)
+
+        files += await asyncio.to_thread(write_manifest)
+    return files
+
+def get_media_links(message, manifest):
     """
-    Create a password-protected zip file containing the chat log and all media files.
+    (image, document, note) for a message in the chat log: archive-relative links to
+    an image to embed and a file to link, and the placeholder text for media that was
+    only kept as a thumbnail or skipped. Missing downloads leave all three None.
     """
-    with pyzipper.AESZipFile(zip_file_path, 'w', compression=pyzipper.ZIP_DEFLATED, encryption=pyzipper.WZ_AES, compresslevel=9) as zipf:
-        zipf.setpassword(password.encode())
-        zipf.write(chat_log_path, 'chat_log.html')
-        logger.info('chat_log.html added to zip.')
-        archive_names = set(['chat_log.html'])
-        def get_unique_archive_name(base_name):
-            if base_name not in archive_names:
-                archive_names.add(base_name)
-                return base_name
-            root, ext = os.path.splitext(base_name)
-            i = 1
-            while True:
-                new_name = f"{root}({i}){ext}"
-                if new_name not in archive_names:
-                    archive_names.add(new_name)
-                    return new_name
-                i += 1
-        for message in messages:
-            if message.photo:
-                fname = f"photo_{message.id}.jpg"
-                fpath = os.path.join(MEDIA_SUBFOLDER, fname)
-                if os.path.exists(fpath):
-                    arcname = get_unique_archive_name(os.path.join('media', fname))
-                    zipf.write(fpath, arcname)
-                    logger.info(f'Added photo to zip: {arcname}')
-            if message.document:
-                fname = message.file.name or f"document_{message.id}"
-                fpath = os.path.join(MEDIA_SUBFOLDER, fname)
-                if not os.path.exists(fpath):
-                    matches = glob.glob(os.path.join(MEDIA_SUBFOLDER, f"document_{message.id}.*"))
-                    if matches:
-                        fpath = matches[0]
-                        fname = os.path.basename(fpath)
-                if os.path.exists(fpath):
-                    arcname = get_unique_archive_name(os.path.join('media', fname))
-                    zipf.write(fpath, arcname)
-                    logger.info(f'Added document to zip: {arcname}')
-
-async def fetch_messages(group_id, min_id=None):
+    if not manifest or not (message.photo or message.document):
+        return None, None, None
+    entry = manifest.get(message.id)
+    if entry is None:
+        return None, None, manifest.get_skipped(message.id)
+    if entry.note:
+        # Thumbnails are shown as images whatever the original was
+        return entry.arcname, None, entry.note
+    if message.photo:
+        return entry.arcname, None, None
+    return None, entry.arcname, None
+
+@asynccontextmanager
+async def export_session():
     """
-    Fetch messages from a group. If min_id is provided, only fetch messages newer than min_id.
+    Client to export history through: with TAKEOUT a takeout session, which Telegram
+    rate-limits less strictly for exports, otherwise the normal client. Jobs running at
+    the same time share the takeout session.
     """
-    messages = []
-    if min_id:
-        async for message in client.iter_messages(group_id, min_id=min_id):
-            messages.append(message)
-    else:
-        async for message in client.iter_messages(group_id):
-            messages.append(message)
-    return messages
+    if not TAKEOUT:
+        yield client
+        return
+    async with takeout.session() as source:
+        yield source
+
+class StreamJob:
+    """One group's backup for stream_backup: what to fetch, the archive to write and the job's state."""
+    __slots__ = ('group_id', 'workspace', 'zip_file_path', 'password', 'chat_log_title', 'min_id', 'from_index',
+                 'journal', 'metrics', 'progress', 'media_policy', 'previous_archive')
 
-async def save_all_media(messages):
+    def __init__(self, group_id, workspace, zip_file_path, password, chat_log_title, min_id=None, from_index=False,
+                 journal=None, metrics=None, progress=None, media_policy=None, previous_archive=None):
+        self.group_id = group_id
+        # Directory the chat log and media are staged in
+        self.workspace = workspace
+        self.zip_file_path = zip_file_path
+        self.password = password
+        self.chat_log_title = chat_log_title
+        # Messages above min_id are fetched; with from_index those up to it are read from the message index
+        self.min_id = min_id
+        self.from_index = from_index
+        self.journal = journal
+        self.metrics = metrics or JobMetrics('stream')
+        self.progress = progress or ProgressTracker('Backup')
+        self.media_policy = media_policy
+        # Archive that a delta backup (above min_id, not from the index) continues
+        self.previous_archive = previous_archive
+
+async def stream_backup(job, on_volume_sealed=None, source=None):
     """
-    Download all media (photos/documents) from a list of messages.
+    Fetch messages, download their media and archive the files in one streaming pass, skipping
+    work the job's journal records as done. Sealed volumes go to on_volume_sealed right away.
+    Returns the messages (newest first) and the failed downloads.
     """
-    total = len(messages)
-    media_count = sum(1 for m in messages if m.photo or m.document)
-    if media_count == 0:
-        logger.info('No media to download.')
-        return
-    logger.info(f'Starting download of {media_count} media files...')
-    done = 0
-    for idx, message in enumerate(messages, 1):
-        if message.photo or message.document:
-            media_type = 'photo' if message.photo else 'document'
+    group_id, min_id, journal, metrics, progress, media_policy = job.group_id, job.min_id, job.journal, job.metrics, job.progress, job.media_policy
+    source = source or client
+    chat_log_dir = os.path.join(job.workspace, 'chat_log')
+    media_dir = os.path.join(job.workspace, 'media')
+    os.makedirs(media_dir, exist_ok=True)
+    download_queue = asyncio.Queue(maxsize=MAX_CONCURRENT_REQUESTS * 2)
+    archive_queue = asyncio.Queue(maxsize=MAX_CONCURRENT_REQUESTS * 2)
+    messages = []
+    failed = []
+    low_bound = min_id or 0
+    manifest = MediaManifest(media_dir)
+    # Downloads and volumes from an interrupted run of this job
+    for msg_id, (path, size, note, sha256) in (journal.media.items() if journal else ()):
+        manifest.add(msg_id, path, size, note, sha256)
+    archived_ids = journal.archived_media_ids() if journal else set()
+    volumes = VolumeSet(job.zip_file_path, job.password, max_volume_size=VOLUME_SIZE_MB * 1024 * 1024, compresslevel=COMPRESSION_LEVEL, first_volume=get_last_volume_number(journal))
+    archive_workers = ARCHIVE_WORKERS if VOLUME_SIZE_MB else 1
+    slots = [volumes.open_slot() for _ in range(archive_workers)]
+    # Message ids whose media went into each slot's open volume
+    slot_media_ids = {slot: set() for slot in slots}
+
+    async def volume_sealed(volume_path, media_ids, chat_log=False):
+        if volume_path:
+            logger.info(f'Archive volume sealed: {volume_path}')
+            if journal:
+                journal.record_volume(volume_path, media_ids, chat_log=chat_log)
+            if on_volume_sealed:
+                await on_volume_sealed(volume_path)
+
+    async def queue_media(message):
+        if message.id in archived_ids:
+            return
+        finished_path = journal.finished_media(message.id) if journal else None
+        if finished_path:
+            await archive_queue.put((message.id, manifest.get(message.id)))
+        else:
+            await download_queue.put(message)
+
+    async def fetch_range(range_min_id, range_max_id, newest_id, record_progress=True):
+        """
+        Fetch messages with range_min_id < id < range_max_id (0 = no upper bound).
+        Each indexed batch extends the journal's fetched range down from newest_id.
+        """
+        batch = []
+
+        async def flush_batch():
+            nonlocal newest_id
+            if message_index and batch:
+                with metrics.time('index_write', items=len(batch)):
+                    await asyncio.to_thread(message_index.add_messages, group_id, batch)
+                newest_id = newest_id or batch[0].id
+                if journal and record_progress:
+                    journal.record_fetched(newest_id, batch[-1].id)
+            batch.clear()
+
+        with metrics.time('fetch') as fetch:
+            # No fixed pause between pages; FloodWaits are handled by flood_control
+            async for message in source.iter_messages(group_id, min_id=range_min_id, max_id=range_max_id, wait_time=0):
+                messages.append(message)
+                batch.append(message)
+                fetch.items += 1
+                progress.advance('messages')
+                if message.photo or message.document:
+                    await queue_media(message)
+                if len(batch) >= INDEX_BATCH_SIZE:
+                    await flush_batch()
+            await flush_batch()
+
+    async def fetcher():
+        fetched = journal.fetched if journal and message_index else None
+        if fetched:
+            # Resume: fetch what is new above the recorded range, reuse the range from
+            # the index, then continue below it where the interrupted fetch stopped
+            newest_id, oldest_id = fetched
+            logger.info(f'Resuming fetch: messages {oldest_id}-{newest_id} are already in the message index.')
+            # Not recorded until complete, or the journal range would have a gap
+            await fetch_range(fetched[0], 0, None, record_progress=False)
+            if messages:
+                newest_id = messages[0].id
+                journal.record_fetched(newest_id, oldest_id)
+            # Only the recorded range; the messages fetched above it are already in messages
+            await queue_stored_messages(oldest_id, fetched[0])
+            await fetch_range(low_bound, oldest_id, newest_id)
+        else:
+            await fetch_range(low_bound, 0, None)
+        if job.from_index and message_index and low_bound:
+            await queue_stored_messages(None, low_bound)
+        if messages:
+            newest_id = messages[0].id
+            if journal:
+                journal.record_fetch_done(newest_id)
+            # The index is complete up to newest_id if this fetch joined up with its high-water mark
+            if message_index and low_bound <= await asyncio.to_thread(message_index.max_id, group_id):
+                await asyncio.to_thread(message_index.set_max_id, group_id, newest_id)
+        for _ in range(MAX_CONCURRENT_REQUESTS):
+            await download_queue.put(None)
+
+    def policy_decidable(message):
+        # Thumbnails are listed on the real message only, as is the media type of rows stored before it was indexed
+        if not media_policy:
+            return True
+        return message.media_type is not None and media_policy.decide(message)[0] != THUMB
+
+    async def queue_stored_messages(stored_min_id, stored_max_id):
+        with metrics.time('index_read') as read:
+            stored = await asyncio.to_thread(message_index.load_messages, group_id, min_id=stored_min_id, max_id=stored_max_id)
+            read.items = len(stored)
+        logger.info(f'Loaded {len(stored)} messages from the message index.')
+        # Media that is not in the media cache needs the real message to download it
+        refetch_ids = []
+        for message in stored:
+            messages.append(message)
+            progress.advance('messages')
+            if not (message.photo or message.document) or message.id in archived_ids:
+                continue
+            if journal and journal.finished_media(message.id):
+                await queue_media(message)
+            elif media_cache and media_cache.get(message.media_key) and policy_decidable(message):
+                await queue_media(message)
+            else:
+                refetch_ids.append(message.id)
+        for i in range(0, len(refetch_ids), INDEX_BATCH_SIZE):
+            with metrics.time('refetch', items=len(refetch_ids[i:i + INDEX_BATCH_SIZE])):
+                refetched = await source.get_messages(group_id, ids=refetch_ids[i:i + INDEX_BATCH_SIZE])
+            for message in refetched:
+                if message and (message.photo or message.document):
+                    await download_queue.put(message)
+
+    async def downloader():
+        while True:
+            message = await download_queue.get()
+            if message is None:
+                return
             try:
-                await save_media(message)
-                done += 1
-                # Print a simple progress bar
-                bar_len = 30
-                filled_len = int(bar_len * done // media_count)
-                bar = '=' * filled_len + '-' * (bar_len - filled_len)
-                print(f'\r[Downloading {media_type} for msg {message.id}] |{bar}| {done}/{media_count} media files', end='', flush=True)
+                # Waiting for a slot shared with the other groups' jobs is not download time
+                async with download_slots.slot(group_id):
+                    with metrics.time('download') as download:
+                        file_path = await save_media(message, manifest, progress_callback=progress.transfer('download'), policy=media_policy, source=source)
+                        if file_path:
+                            download.items = 1
+                            download.bytes = manifest.get(message.id).size
             except Exception as e:
+                failed.append((message.id, str(e)))
+                metrics.count('download_failures')
+                progress.advance('failed')
                 logger.error(f'Failed to save media for message {message.id}: {e}')
-    print()  # Newline after progress bar
-    logger.info('All media downloads complete.')
+                continue
+            if not file_path:
+                if manifest.get_skipped(message.id):
+                    metrics.count('media_skipped')
+                    progress.advance('skipped')
+                continue
+            entry = manifest.get(message.id)
+            if entry.note:
+                metrics.count('media_thumbnails')
+            with metrics.time('hash', items=1, bytes=entry.size):
+                entry.sha256 = await asyncio.to_thread(file_sha256, entry.path)
+            progress.advance('downloaded')
+            if journal:
+                journal.record_media(message.id, entry.path, entry.size, entry.note, entry.sha256)
+            await archive_queue.put((message.id, entry))
+
+    async def archiver(slot):
+        while True:
+            item = await archive_queue.get()
+            if item is None:
+                return
+            msg_id, entry = item
+            with metrics.time('archive', items=1, bytes=entry.size):
+                sealed = await asyncio.to_thread(slot.add, entry.path, entry.arcname)
+            if sealed:
+                await volume_sealed(sealed, slot_media_ids[slot])
+                slot_media_ids[slot] = set()
+            slot_media_ids[slot].add(msg_id)
+            progress.advance('archived')
+
+    archive_tasks = [asyncio.create_task(archiver(slot)) for slot in slots]
+    fetch_tasks = [asyncio.create_task(fetcher())] + [asyncio.create_task(downloader()) for _ in range(MAX_CONCURRENT_REQUESTS)]
+
+    async def finish_downloads():
+        await asyncio.gather(*fetch_tasks)
+        for _ in archive_tasks:
+            await archive_queue.put(None)
 
-async def backup_and_send(event, messages, zip_prefix, chat_log_title, update_last_backup=False):
+    chat_log_slot = None
+    try:
+        await asyncio.gather(finish_downloads(), *archive_tasks)
+        logger.info(f'Fetched {len(messages)} messages, downloaded {len(manifest)} media files ({len(failed)} failed).')
+        if messages:
+            with metrics.time('chat_log', items=len(messages)) as render:
+                archive_kind = DELTA if min_id and not job.from_index else FULL_ARCHIVE
+                chat_log_files = await generate_topic_grouped_chat_log(group_id, messages, chat_log_dir, title=job.chat_log_title, manifest=manifest,
+                                                                       archive_name=archive_stem(job.zip_file_path), archive_kind=archive_kind, previous_archive=job.previous_archive if archive_kind == DELTA else None)
+                render.bytes = sum(os.path.getsize(path) for path, _ in chat_log_files)
+            logger.info(f'Chat log generated in {chat_log_dir} ({len(chat_log_files)} files)')
+            chat_log_slot = slots[0]
+            for path, arcname in chat_log_files:
+                with metrics.time('archive', items=1, bytes=os.path.getsize(path)):
+                    sealed = await asyncio.to_thread(chat_log_slot.add, path, arcname)
+                if sealed:
+                    await volume_sealed(sealed, slot_media_ids[chat_log_slot])
+                    slot_media_ids[chat_log_slot] = set()
+            logger.info('Chat log added to zip.')
+    except BaseException:
+        # Unsealed volumes are incomplete; they are not recorded and get rebuilt on resume
+        for slot in slots:
+            await asyncio.to_thread(slot.close)
+        raise
+    finally:
+        for task in fetch_tasks + archive_tasks:
+            task.cancel()
+        if media_cache:
+            await asyncio.to_thread(media_cache.save)
+    for slot in slots:
+        await volume_sealed(await asyncio.to_thread(slot.close), slot_media_ids[slot], chat_log=slot is chat_log_slot)
+    return messages, failed
+
+def get_last_volume_number(journal):
+    """Highest part number among the volumes recorded in the journal."""
+    numbers = [0]
+    for path in (journal.volumes if journal else {}):
+        match = re.search(r'\.part(\d+)\.zip$', path)
+        if match:
+            numbers.append(int(match.group(1)))
+    return max(numbers)
+
+def enabled_destinations():
+    return [destination for destination, enabled in ((TELEGRAM_DESTINATION, SEND_TO_TELEGRAM), (GDRIVE_DESTINATION, GDRIVE_ENABLED)) if enabled]
+
+async def deliver_archive(event, zip_file_path, zip_prefix, metrics=None, progress=None, group_id=None, destinations=None):
     """
-    Generate chat log, zip files, send to admin, update backup state, and clean up.
+    Send a finished archive to the admin on Telegram and upload it to Google Drive at the
+    same time, then reply with one combined status message. Either destination can be
+    turned off in the config. Up to MAX_PARALLEL_DELIVERIES archives are delivered at once,
+    shared evenly between the groups of the running jobs. destinations limits the delivery to
+    some of the enabled ones, e.g. those a resumed job has not reached yet.
+    Returns {destination: True if it received the archive}.
     """
-    chat_log_path = os.path.join(COLLECTED_FILES_DIR, 'chat_log.html')
-    await generate_topic_grouped_chat_log(messages, chat_log_path, title=chat_log_title)
-    logger.info(f'chat_log.html generated at {chat_log_path}')
-    date_str = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-    zip_file_path = os.path.join(COLLECTED_FILES_DIR, f'{zip_prefix}_{date_str}.zip')
-    password = DEFAULT_PASSWORD
-    PASSWORD_RANDOMLY_GENERATED = False
-    if password == '0':
-        password = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
-        PASSWORD_RANDOMLY_GENERATED = True
-    logger.info(f'Creating zip file: {zip_file_path}')
-    await zip_files(messages, chat_log_path, zip_file_path, password)
-    await event.respond(f'Backup complete. Uploading the file...\nPassword: {password if PASSWORD_RANDOMLY_GENERATED else "(default)"}')
-    if SEND_TO_TELEGRAM:
-        def tg_progress_bar(current, total):
-            bar_len = 30
-            if total == 0:
-                percent = 0
-            else:
-                percent = current / total
-            filled_len = int(bar_len * percent)
-            bar = '=' * filled_len + '-' * (bar_len - filled_len)
-            mb_current = current / (1024 * 1024)
-            mb_total = total / (1024 * 1024) if total else 0
-            print(f'\r[Telegram Upload] |{bar}| {mb_current:.2f}/{mb_total:.2f} MB', end='', flush=True)
-            if current == total:
-                print()
+    metrics = metrics or JobMetrics(zip_prefix)
+    progress = progress or ProgressTracker(zip_prefix)
+    archive_name = os.path.basename(zip_file_path)
+    archive_size = os.path.getsize(zip_file_path)
+
+    async def send_to_telegram():
+        tg_progress = progress.transfer('Telegram upload')
+        try:
+            with metrics.time('telegram_upload') as upload:
+                file = zip_file_path
+                parallel_min_size = max(PARALLEL_UPLOAD_MIN_SIZE_MB * 1024 * 1024, BIG_FILE_MIN_SIZE + 1)
+                if PARALLEL_UPLOAD_CONNECTIONS > 1 and archive_size >= parallel_min_size:
+                    try:
+                        file = await upload_file_parallel(client, zip_file_path, connections=PARALLEL_UPLOAD_CONNECTIONS, progress_callback=tg_progress, flood_control=flood_control)
+                    except Exception as e:
+                        metrics.count('telegram_parallel_upload_fallbacks')
+                        logger.warning(f'Parallel upload of {archive_name} failed, falling back to a single connection: {e}')
+                await client.send_file(ADMIN_ID, file, progress_callback=tg_progress, force_document=True)
+                upload.items, upload.bytes = 1, archive_size
+            logger.info(f'{archive_name} sent to admin.')
+            return True, '+ Sent to Telegram.'
+        except Exception as e:
+            metrics.count('telegram_upload_failures')
+            logger.error(f'Error sending {zip_prefix} zip {archive_name}: {e}')
+            return False, f'- Failed to send to Telegram: {e}'
+
+    async def upload_to_gdrive():
+        def on_retry(reason):
+            metrics.count('gdrive_retries')
+            metrics.count(f'gdrive_retries_{reason}')
+
         try:
-            await client.send_file(ADMIN_ID, zip_file_path, progress_callback=tg_progress_bar)
-            logger.info(f'{zip_prefix} zip sent to admin.')
+            with metrics.time('gdrive_upload') as upload:
+                gdrive_file_id = await upload_file_to_gdrive_async(zip_file_path, chunk_size=GDRIVE_CHUNK_SIZE_MB * 1024 * 1024, adaptive_chunk_size=GDRIVE_ADAPTIVE_CHUNK_SIZE, on_retry=on_retry, progress_callback=progress.transfer('Drive upload'))
+                upload.items, upload.bytes = 1, archive_size
+            logger.info(f'Uploaded {archive_name} to Google Drive, file id: {gdrive_file_id}')
+            return True, f'+ Backup uploaded to Google Drive.\nhttps://drive.google.com/file/d/{gdrive_file_id}/view'
         except Exception as e:
-            logger.error(f'Error sending {zip_prefix} zip: {e}')
-            await event.respond(f'Failed to send {zip_prefix} zip.')
-    # Upload to Google Drive before deleting
+            metrics.count('gdrive_upload_failures')
+            logger.error(f'Error uploading {archive_name} to Google Drive: {e}')
+            return False, f'- Failed to upload backup to Google Drive: {e}'
+
+    deliveries = {TELEGRAM_DESTINATION: send_to_telegram, GDRIVE_DESTINATION: upload_to_gdrive}
+    if destinations is None:
+        destinations = enabled_destinations()
+    async with delivery_slots.slot(group_id):
+        results = await asyncio.gather(*(deliveries[destination]() for destination in destinations))
+    await event.respond('\n'.join([f'{archive_name}:'] + [text for _, text in results]))
+    return {destination: delivered for destination, (delivered, _) in zip(destinations, results)}
+
+def find_interrupted_workspace(zip_prefix):
+    """Workspace of the latest unfinished job with this zip prefix, or None."""
+    for name in sorted(os.listdir(JOBS_DIR), reverse=True):
+        workspace = os.path.join(JOBS_DIR, name)
+        if name.startswith(zip_prefix + '_') and os.path.exists(os.path.join(workspace, JOURNAL_NAME)):
+            return workspace
+    return None
+
+async def backup_and_send(event, group_id, zip_prefix, chat_log_title, min_id=None, update_last_backup=False, from_index=False, media_policy=None):
+    """
+    Run a backup job with metrics: stage timings and counters are added to the Prometheus
+    totals and written as a JSON summary to METRICS_DIR, whether the job succeeds or not.
+    Returns the messages that were backed up.
+    """
+    metrics = JobMetrics(zip_prefix)
+    metrics_registry.start_job(metrics)
+    status = 'failed'
     try:
-        gdrive_file_id = upload_file_to_gdrive(zip_file_path)
-        logger.info(f'Uploaded zip to Google Drive, file id: {gdrive_file_id}')
-        await event.respond(f'+ Backup uploaded to Google Drive.\nhttps://drive.google.com/file/d/{gdrive_file_id}/view')
-    except Exception as e:
-        logger.error(f'Error uploading to Google Drive: {e}')
-        await event.respond(f'Failed to upload backup to Google Drive: {e}')
-    # Wait briefly to ensure all file handles are released
-    time.sleep(0.5)
-    
-    cleanup_collected_files(LAST_BACKUP_FILE, logger, after=zip_prefix)
+        messages = await run_backup_job(event, group_id, zip_prefix, chat_log_title, metrics, min_id=min_id, update_last_backup=update_last_backup, from_index=from_index, media_policy=media_policy)
+        status = metrics.status or 'ok'
+        return messages
+    finally:
+        metrics.finish(status)
+        metrics_registry.finish_job(metrics)
+        try:
+            summary_path = await asyncio.to_thread(metrics.write, METRICS_DIR)
+            logger.info(f'Job metrics written to {summary_path}')
+        except Exception as e:
+            logger.error(f'Failed to write job metrics: {e}')
+
+async def run_backup_job(event, group_id, zip_prefix, chat_log_title, metrics, min_id=None, update_last_backup=False, from_index=False, media_policy=None):
+    """
+    Stream a group's messages and media into a zip file, send to admin, update the group's
+    backup state, and clean up.
+    In volume mode each volume is delivered as soon as it is sealed. With from_index the
+    backup is rendered from the local message index plus newer messages from Telegram.
+    Everything the job writes lives in its own workspace under JOBS_DIR, so cleanup is a
+    single directory removal. An interrupted job with the same zip_prefix is resumed from
+    the journal in its workspace.
+    Returns the messages that were backed up.
+    """
+    status_message = AdminStatusMessage() if STATUS_MESSAGE else None
+    progress = ProgressTracker(zip_prefix, interval=PROGRESS_INTERVAL, update_interval=STATUS_MESSAGE_INTERVAL,
+                               on_update=status_message.update if status_message else None)
+
+    if len(GROUP_IDS) > 1:
+        # Notices of jobs running side by side would be indistinguishable otherwise
+        group_title = await get_group_title(group_id)
+
+    async def notify(text):
+        if len(GROUP_IDS) > 1:
+            text = f'{group_title}: {text}'
+        # With a status message the notice becomes part of the edited message instead of a new one
+        progress.set_status(text)
+        if not status_message:
+            await event.respond(text)
+
+    progress.start()
+    try:
+        workspace = find_interrupted_workspace(zip_prefix)
+        journal = BackupJournal(os.path.join(workspace, JOURNAL_NAME)) if workspace else None
+        job = journal.resumable_job(zip_prefix) if journal else None
+        if job:
+            zip_file_path = job['zip_file_path']
+            password = job['password']
+            min_id = job['min_id']
+            PASSWORD_RANDOMLY_GENERATED = password != DEFAULT_PASSWORD
+            logger.info(f'Resuming interrupted job for {zip_file_path}')
+            await notify('Resuming the interrupted backup...')
+        else:
+            if workspace:
+                # Journal without a start record; nothing in it can be reused
+                await asyncio.to_thread(cleanup_workspace, workspace, after=zip_prefix)
+            date_str = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+            workspace = os.path.join(JOBS_DIR, f'{zip_prefix}_{date_str}')
+            os.makedirs(workspace, exist_ok=True)
+            zip_file_path = os.path.join(workspace, f'{zip_prefix}_{date_str}.zip')
+            password = DEFAULT_PASSWORD
+            PASSWORD_RANDOMLY_GENERATED = False
+            if password == '0':
+                password = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
+                PASSWORD_RANDOMLY_GENERATED = True
+            if from_index and message_index:
+                min_id = max(min_id or 0, message_index.max_id(group_id))
+                logger.info(f'Message index holds messages up to {min_id}; fetching newer messages only.')
+            journal = BackupJournal(os.path.join(workspace, JOURNAL_NAME))
+            journal.start(zip_prefix, zip_file_path, min_id, password)
+        password_note = password if PASSWORD_RANDOMLY_GENERATED else "(default)"
+        sealed_volumes = []
+        delivery_tasks = []
+
+        destinations = enabled_destinations()
+
+        async def deliver(volume_path):
+            # A resumed job only retries the destinations that did not receive the volume
+            missing = journal.missing_destinations(volume_path, destinations)
+            if not missing:
+                return
+            results = await deliver_archive(event, volume_path, zip_prefix, metrics=metrics, progress=progress, group_id=group_id, destinations=missing)
+            for destination, delivered in results.items():
+                if delivered:
+                    journal.record_delivered(volume_path, destination)
+                else:
+                    journal.record_delivery_failed(volume_path, destination)
+
+        async def on_volume_sealed(volume_path):
+            sealed_volumes.append(volume_path)
+            if VOLUME_SIZE_MB:
+                if len(sealed_volumes) == 1:
+                    await notify(f'Uploading backup volumes as they are completed...\nPassword: {password_note}')
+                delivery_tasks.append(asyncio.create_task(deliver(volume_path)))
 
-    if update_last_backup and messages:
-        set_last_backup_id(messages[0].id)
-        logger.info(f'Updated last backup ID to {messages[0].id}')
+        # Volumes built before an interruption that did not reach every destination
+        for volume_path in journal.undelivered_volumes(destinations):
+            await on_volume_sealed(volume_path)
+        messages, failed = [], []
+        if not journal.has_chat_log_volume():
+            logger.info(f'Creating zip file: {zip_file_path}')
+            try:
+                async with export_session() as source:
+                    stream_job = StreamJob(group_id, workspace, zip_file_path, password, chat_log_title, min_id=min_id, from_index=from_index, journal=journal,
+                                           metrics=metrics, progress=progress, media_policy=media_policy, previous_archive=get_last_archive(group_id))
+                    messages, failed = await stream_backup(stream_job, on_volume_sealed=on_volume_sealed, source=source)
+            except BaseException:
+                for task in delivery_tasks:
+                    task.cancel()
+                raise
+        newest_id = journal.newest_id
+        if newest_id is None:
+            logger.info('No new messages to backup.')
+            await notify('No new messages since last backup.')
+            metrics.status = 'empty'
+            await asyncio.to_thread(cleanup_workspace, workspace, after=zip_prefix)
+            return messages
+        throttled = metrics.counters.get('telegram_flood_wait_seconds')
+        if throttled:
+            await notify(f'Telegram rate limits held this backup for {throttled:.0f}s in total.')
+        if failed:
+            await notify(f'{len(failed)} media files could not be downloaded and will be missing from the backup.')
+        if VOLUME_SIZE_MB:
+            await notify(f'Backup complete in {len(sealed_volumes)} volumes. Waiting for uploads to finish...')
+        else:
+            await notify(f'Backup complete. Uploading the file...\nPassword: {password_note}')
+            delivery_tasks.extend(asyncio.create_task(deliver(volume_path)) for volume_path in sealed_volumes)
+        await asyncio.gather(*delivery_tasks)
+        undelivered = [path for path in sealed_volumes if destinations and not journal.delivered_to(path)]
+        if undelivered and max(journal.delivery_attempts(path) for path in undelivered) < DELIVERY_ATTEMPTS:
+            # The journal keeps the undelivered volumes; the next run of this job sends them again
+            await notify(f'{len(undelivered)} archive(s) could not be delivered. The backup is kept and will be sent again on the next run.')
+            metrics.status = 'undelivered'
+            return messages
+        # Archives that missed a destination are kept locally rather than retried, so a
+        # destination that keeps failing never holds up the group's later backups
+        kept = [path for path in sealed_volumes if journal.missing_destinations(path, destinations)]
+        if kept:
+            await notify(f'{len(kept)} archive(s) did not reach every destination and are kept in {COLLECTED_FILES_DIR}.')
+            metrics.status = 'partially_delivered'
+        # Wait briefly to ensure all file handles are released
+        await asyncio.sleep(0.5)
+
+        if update_last_backup:
+            # The next delta points back to this archive only if it was delivered or kept somewhere
+            archive_stored = destinations or not DELETE_FILES_AFTER_UPLOAD
+            set_last_backup_id(group_id, newest_id, archive=archive_stem(zip_file_path) if archive_stored else None)
+            logger.info(f'Updated last backup ID of {group_id} to {newest_id}')
+        # Removing the workspace also removes the journal, which marks the job as finished
+        with metrics.time('cleanup'):
+            await asyncio.to_thread(cleanup_workspace, workspace, after=zip_prefix, keep_archives=bool(kept))
+        return messages
+    finally:
+        await progress.stop()
+
+class AdminChat:
+    """
+    Reply target for backup jobs. Commands only come from the admin's private chat, so
+    replying there works the same for command-triggered and scheduled jobs.
+    """
+
+    async def respond(self, message):
+        return await client.send_message(ADMIN_ID, message)
+
+admin_chat = AdminChat()
+
+class AdminStatusMessage:
+    """One message in the admin chat that is sent on the first update and edited afterwards."""
+
+    def __init__(self):
+        self.message = None
+
+    async def update(self, text):
+        if self.message is None:
+            self.message = await client.send_message(ADMIN_ID, text)
+        else:
+            await client.edit_message(ADMIN_ID, self.message, text)
+
+async def get_group_title(group_id):
+    """Title of a group for messages and chat logs, falling back to its id."""
+    if group_id not in _group_titles:
+        try:
+            entity = await client.get_entity(group_id)
+            _group_titles[group_id] = getattr(entity, 'title', None) or str(group_id)
+        except Exception as e:
+            logger.warning(f'Could not look up the title of group {group_id}: {e}')
+            _group_titles[group_id] = str(group_id)
+    return _group_titles[group_id]
+
+def group_zip_prefix(kind, group_id):
+    """Zip prefix of a group's backups, e.g. archive_backup_1001234567890."""
+    return f'{kind}_{abs(group_id)}'
+
+async def run_full_backup(group_id):
+    group_title = await get_group_title(group_id)
+    await admin_chat.respond(f'Starting backup of {group_title}...')
+    logger.info(f'Running /backup_now job for {group_id}')
+    return await backup_and_send(admin_chat, group_id, group_zip_prefix('archive_backup', group_id), f'Telegram Archive Backup - {group_title}', update_last_backup=True, from_index=True, media_policy=MEDIA_POLICY)
+
+async def run_sync_backup(group_id):
+    group_title = await get_group_title(group_id)
+    await admin_chat.respond(f'Starting incremental backup of {group_title}...')
+    # Read when the job starts, so a backup that ran just before it is taken into account
+    last_id = get_last_backup_id(group_id)
+    logger.info(f'Last backup message ID of {group_id}: {last_id}')
+    messages = await backup_and_send(admin_chat, group_id, group_zip_prefix('archive_sync', group_id), f'Telegram Archive Backup - {group_title} (Incremental)', min_id=(last_id or 0), update_last_backup=True, media_policy=SYNC_MEDIA_POLICY)
+    if messages:
+        logger.info(f'New message IDs: {[m.id for m in messages]}')
+    return messages
+
+async def schedule_backups(kind, run, name):
+    """
+    Queue a backup job for every group and tell the admin in one message which
+    were merged into a job that is already queued or running, or have to wait.
+    """
+    merged, waiting = [], []
+    for group_id in GROUP_IDS:
+        # Jobs of one group share its watermark and message index range, so they run one at a time
+        job, was_merged = scheduler.submit((kind, group_id), lambda group_id=group_id: run(group_id), lane=group_id)
+        if was_merged:
+            merged.append(group_id)
+        elif scheduler.jobs_ahead(job):
+            waiting.append(group_id)
+    notices = []
+    if merged:
+        notices.append(f'{name.capitalize()} of {len(merged)} group(s) is already queued or running; this request was merged into it.')
+    if waiting:
+        notices.append(f'{name.capitalize()} of {len(waiting)} group(s) queued; up to {MAX_PARALLEL_BACKUPS} backups run at once.')
+    if notices:
+        await admin_chat.respond('\n'.join(notices))
+
+async def periodic_sync():
+    """Queue /backup_sync every SYNC_INTERVAL_MINUTES so each incremental backup stays small."""
+    while True:
+        await asyncio.sleep(SYNC_INTERVAL_MINUTES * 60)
+        logger.info('Scheduling periodic incremental backups.')
+        await schedule_backups('sync', run_sync_backup, 'an incremental backup')
 
 @client.on(events.NewMessage(pattern='/backup_now'))
 async def handler(event):
     """
-    Handle /backup_now command: full backup of all messages/media.
+    Handle /backup_now command: full backup of all messages/media of every group.
     """
     if event.is_private and event.sender_id == ADMIN_ID:
         try:
             await event.message.mark_read()
         except Exception as e:
             logger.error(f'Could not mark /backup_now message as read: {e}')
-        await event.respond('Starting backup...')
         logger.info('Handler triggered for /backup_now')
-        messages = await fetch_messages(GROUP_ID)
-        await save_all_media(messages)
-        await backup_and_send(event, messages, 'archive_backup', 'Telegram Archive Backup')
-        if messages:
-            set_last_backup_id(messages[0].id)
-            logger.info(f'Updated last backup ID to {messages[0].id} (full backup)')
+        await schedule_backups('full', run_full_backup, 'a full backup')
     else:
         await event.respond('Unauthorized or not in private chat.')
 
 @client.on(events.NewMessage(pattern='/backup_sync'))
 async def sync_handler(event):
     """
-    Handle /backup_sync command: incremental backup of new messages/media since last backup.
+    Handle /backup_sync command: incremental backup of new messages/media of every group since its last backup.
     """
     if event.is_private and event.sender_id == ADMIN_ID:
         logger.info('Received /backup_sync command from admin.')
@@ -481,117 +852,116 @@ async def sync_handler(event):
             logger.info('Marked /backup_sync message as read.')
         except Exception as e:
             logger.error(f'Could not mark /backup_sync message as read: {e}')
-        await event.respond('Starting incremental backup...')
-        last_id = get_last_backup_id()
-        logger.info(f'Last backup message ID: {last_id}')
-        messages = await fetch_messages(GROUP_ID, min_id=(last_id or 0))
-        logger.info(f'Found {len(messages)} new messages since last backup.')
-        if messages:
-            logger.info(f'New message IDs: {[m.id for m in messages]}')
-        if not messages:
-            logger.info('No new messages to backup.')
-            await event.respond('No new messages since last backup.')
-            return
-        await save_all_media(messages)
-        await backup_and_send(event, messages, 'archive_sync', 'Telegram Archive Backup (Incremental)', update_last_backup=True)
+        await schedule_backups('sync', run_sync_backup, 'an incremental backup')
     else:
         await event.respond('Unauthorized or not in private chat.')
 
-async def save_media(message):
+async def save_media(message, manifest, progress_callback=None, policy=None, source=None):
     """
-    Download a single media file (photo or document) from a message.
+    Download a single media file (photo or document) from a message and record it in the manifest.
+    The policy may reduce the download to Telegram's thumbnail or skip it; skipped media is
+    recorded in the manifest with the reason. Returns the saved path, or None if nothing was saved.
+    The file is downloaded through source, by default the client.
     """
-    import os, sys
-    def get_unique_path(base_path):
-        if not os.path.exists(base_path):
-            return base_path
-        root, ext = os.path.splitext(base_path)
-        i = 1
-        while True:
-            new_path = f"{root}({i}){ext}"
-            if not os.path.exists(new_path):
-                return new_path
-            i += 1
-
-    def progress_bar(current, total):
-        bar_len = 30
-        if total == 0:
-            percent = 0
-        else:
-            percent = current / total
-        filled_len = int(bar_len * percent)
-        bar = '=' * filled_len + '-' * (bar_len - filled_len)
-        mb_current = current / (1024 * 1024)
-        mb_total = total / (1024 * 1024) if total else 0
-        print(f'\r[File Download] |{bar}| {mb_current:.2f}/{mb_total:.2f} MB', end='', flush=True)
-        if current == total:
-            print()  # Newline after complete
-
+    source = source or client
     if message.photo:
-        file_path = os.path.join(MEDIA_SUBFOLDER, f"photo_{message.id}.jpg")
-        file_path = get_unique_path(file_path)
-        await client.download_media(message, file_path, progress_callback=progress_bar)
+        file_name = f"photo_{message.id}.jpg"
     elif message.document:
         file_name = message.file.name or f"document_{message.id}"
-        file_path = os.path.join(MEDIA_SUBFOLDER, file_name)
-        file_path = get_unique_path(file_path)
-        await client.download_media(message, file_path, progress_callback=progress_bar)
+        if not os.path.splitext(file_name)[1]:
+            # Add the extension up front; otherwise telethon appends one and the claimed name is lost
+            file_name += getattr(message.file, 'ext', None) or ''
+    else:
+        return None
+    mode, reason = policy.decide(message) if policy else (FULL, None)
+    if mode == THUMB:
+        thumb = select_thumbnail(message)
+        if thumb is None:
+            mode, reason = SKIP, f'{reason}, no thumbnail'
+    if mode != FULL:
+        size = getattr(message.file, 'size', None)
+        label = f'{file_name} ({format_size(size)})' if size else file_name
+        note = f'{label}: {"thumbnail only" if mode == THUMB else "not downloaded"} ({reason})'
+    if mode == SKIP:
+        manifest.skip(message.id, note)
+        return None
+    if mode == THUMB:
+        thumb_path = manifest.claim(f'{os.path.splitext(file_name)[0]}_thumb.jpg')
+        downloaded_path = await source.download_media(message, thumb_path, thumb=thumb)
+        if not downloaded_path:
+            manifest.skip(message.id, note)
+            return None
+        manifest.add(message.id, downloaded_path, note=note)
+        return downloaded_path
+    file_path = manifest.claim(file_name)
+    media_key = get_media_key(message) if media_cache else None
+    while media_key:
+        if media_key in _media_downloads:
+            # Same file is already being downloaded for another message; reuse it
+            await asyncio.shield(_media_downloads[media_key])
+        # Restoring can copy a large file, so it runs off the event loop
+        cached_path = await asyncio.to_thread(media_cache.restore, media_key, file_path)
+        if cached_path:
+            manifest.add(message.id, cached_path)
+            return cached_path
+        # A download of the same file may have started while the cache was read
+        if media_key not in _media_downloads:
+            break
+    download = asyncio.get_running_loop().create_future()
+    if media_key:
+        _media_downloads[media_key] = download
+    try:
+        downloaded_path = await source.download_media(message, file_path, progress_callback=progress_callback)
+        if downloaded_path:
+            manifest.add(message.id, downloaded_path)
+            if media_key:
+                await asyncio.to_thread(media_cache.put, media_key, downloaded_path)
+        return downloaded_path
+    finally:
+        download.set_result(None)
+        if _media_downloads.get(media_key) is download:
+            del _media_downloads[media_key]
 
-def cleanup_collected_files(last_backup_file, logger, after='backup'):
+def cleanup_workspace(workspace, after='backup', keep_archives=False):
     """
-    Remove all files and directories in COLLECTED_FILES_DIR except the zip file and last_backup_id.txt.
+    Remove a job's workspace. It is first renamed out of the way, which is atomic, so a
+    crash during the removal never leaves a half-deleted job that looks resumable.
+    With keep_archives, or unless DELETE_FILES_AFTER_UPLOAD is set, the archives are kept
+    in COLLECTED_FILES_DIR.
     """
-    if DELETE_FILES_AFTER_UPLOAD:
-        # Delete all files except last_backup_file
-        for root, dirs, files in os.walk(COLLECTED_FILES_DIR, topdown=False):
-            for name in files:
-                file_path = os.path.join(root, name)
-                if file_path != last_backup_file:
-                    try:
-                        os.remove(file_path)
-                        logger.info(f'Removed file after {after}: {file_path}')
-                    except Exception as e:
-                        logger.error(f'Error removing file {file_path}: {e}')
-            for name in dirs:
-                dir_path = os.path.join(root, name)
-                try:
-                    os.rmdir(dir_path)
-                    logger.info(f'Removed directory after {after}: {dir_path}')
-                except Exception as e:
-                    logger.error(f'Error removing directory {dir_path}: {e}')
-    else:
-        # Only delete the media folder and chat_log.html
-        chat_log_path = os.path.join(COLLECTED_FILES_DIR, 'chat_log.html')
-        if os.path.exists(chat_log_path):
-            try:
-                os.remove(chat_log_path)
-                logger.info(f'Removed chat log: {chat_log_path}')
-            except Exception as e:
-                logger.error(f'Error removing chat log {chat_log_path}: {e}')
-        if os.path.exists(MEDIA_SUBFOLDER):
-            for root, dirs, files in os.walk(MEDIA_SUBFOLDER, topdown=False):
-                for name in files:
-                    file_path = os.path.join(root, name)
-                    try:
-                        os.remove(file_path)
-                        logger.info(f'Removed media file: {file_path}')
-                    except Exception as e:
-                        logger.error(f'Error removing media file {file_path}: {e}')
-                for name in dirs:
-                    dir_path = os.path.join(root, name)
-                    try:
-                        os.rmdir(dir_path)
-                        logger.info(f'Removed media subdir: {dir_path}')
-                    except Exception as e:
-                        logger.error(f'Error removing media subdir {dir_path}: {e}')
-            try:
-                os.rmdir(MEDIA_SUBFOLDER)
-                logger.info(f'Removed media folder: {MEDIA_SUBFOLDER}')
-            except Exception as e:
-                logger.error(f'Error removing media folder {MEDIA_SUBFOLDER}: {e}')
+    if keep_archives or not DELETE_FILES_AFTER_UPLOAD:
+        for entry in os.scandir(workspace):
+            if entry.name.endswith('.zip'):
+                os.replace(entry.path, os.path.join(COLLECTED_FILES_DIR, entry.name))
+                logger.info(f'Kept archive after {after}: {entry.name}')
+    removed_path = workspace + REMOVED_SUFFIX
+    try:
+        os.replace(workspace, removed_path)
+    except OSError as e:
+        logger.error(f'Error removing workspace {workspace}: {e}')
+        return
+    shutil.rmtree(removed_path, ignore_errors=True)
+    logger.info(f'Removed workspace after {after}: {workspace}')
+
+def remove_stale_workspaces():
+    """Finish removals that were cut short by a crash or restart."""
+    for entry in os.scandir(JOBS_DIR):
+        if entry.name.endswith(REMOVED_SUFFIX):
+            shutil.rmtree(entry.path, ignore_errors=True)
 
 
 if __name__ == '__main__':
     client.start(phone=PHONE)
+    remove_stale_workspaces()
+    if PROMETHEUS_PORT:
+        client.loop.run_until_complete(serve_prometheus(metrics_registry, PROMETHEUS_HOST, PROMETHEUS_PORT))
+        logger.info(f'Serving metrics on http://{PROMETHEUS_HOST}:{PROMETHEUS_PORT}/metrics')
+    if SYNC_INTERVAL_MINUTES > 0:
+        client.loop.create_task(periodic_sync())
+        logger.info(f'Incremental backups scheduled every {SYNC_INTERVAL_MINUTES} minutes.')
+    if not GROUP_IDS:
+        logger.warning('No GROUP_ID configured; /backup_now and /backup_sync have nothing to back up.')
+    if not SEND_TO_TELEGRAM and not GDRIVE_ENABLED:
+        logger.warning('SEND_TO_TELEGRAM and Google Drive upload are both disabled; archives are not delivered anywhere.')
     print('Telegram backup bot running...')
     client.run_until_disconnected()
@@ -0,0 +1,248 @@
+"""
+Merge a chain of backup archives into one directory with a single chat log.
+
+    python src/restore.py ARCHIVE_OR_DIRECTORY [...] -o restored -p PASSWORD [-p PASSWORD ...]
+
+Each archive holds a manifest that names the archive before it. For every group the
+newest archive (or --until) is followed back through its delta archives to the last
+full one, and the chain is applied oldest first: message rows are merged by id, newer
+archives winning, and each distinct media file (by hash) is extracted once. Only the
+manifest, the message rows and the needed media entries are read from the archives;
+their own chat logs are never unpacked.
+"""
+import argparse
+import getpass
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+from collections import defaultdict
+import pyzipper
+from utils.colorlog import logger
+from utils.archive_manifest import DELTA, MANIFEST_NAME, MESSAGES_NAME, archive_stem
+from utils.chat_log import PAGE_SIZE, write_chat_log
+
+COPY_BUFFER_SIZE = 1024 * 1024
+MEDIA_DIR = 'media'
+# Message rows of the chain are merged here, so memory use does not grow with the history
+DATABASE_NAME = '.restore.sqlite'
+
+
+class Archive:
+    """
+    One archive opened across all its volumes. Opening reads only the central directory
+    of each volume; entries are decrypted when they are read.
+    """
+
+    def __init__(self, stem, paths):
+        self.stem = stem
+        self.volumes = [pyzipper.AESZipFile(path) for path in sorted(paths)]
+        # arcname -> volume holding it
+        self.entries = {}
+        for volume in self.volumes:
+            for name in volume.namelist():
+                self.entries[name] = volume
+        self.manifest = None
+        self.password = None
+
+    def load_manifest(self, passwords):
+        """Read the manifest with the first password that opens it. Returns False for archives without one."""
+        if MANIFEST_NAME not in self.entries:
+            return False
+        for password in passwords:
+            try:
+                with self.entries[MANIFEST_NAME].open(MANIFEST_NAME, pwd=password.encode()) as f:
+                    self.manifest = json.load(f)
+            except RuntimeError:
+                # Wrong password
+                continue
+            self.password = password.encode()
+            return True
+        raise ValueError(f'None of the passwords opens {self.stem}')
+
+    def open(self, arcname):
+        return self.entries[arcname].open(arcname, pwd=self.password)
+
+    def close(self):
+        for volume in self.volumes:
+            volume.close()
+
+
+def open_archives(inputs, passwords):
+    """Archives with a manifest among the given zip files and directories of zip files."""
+    volumes = defaultdict(list)
+    for path in inputs:
+        paths = glob.glob(os.path.join(path, '*.zip')) if os.path.isdir(path) else [path]
+        for volume_path in paths:
+            volumes[archive_stem(volume_path)].append(volume_path)
+    archives = []
+    try:
+        for stem, paths in sorted(volumes.items()):
+            archive = Archive(stem, paths)
+            archives.append(archive)
+            if not archive.load_manifest(passwords):
+                logger.warning(f'{stem} has no archive manifest; it was made before manifests were added and is skipped.')
+                archives.pop().close()
+    except BaseException:
+        for archive in archives:
+            archive.close()
+        raise
+    return archives
+
+
+def find_chains(archives, until=None):
+    """
+    Archives to apply for each group, oldest first: the newest archive (or the one named
+    until) and the archives its previous pointers lead back to, ending at a full archive.
+    """
+    by_stem = {archive.stem: archive for archive in archives}
+    if until:
+        if until not in by_stem:
+            raise ValueError(f'Archive {until} not found')
+        heads = [by_stem[until]]
+    else:
+        newest = {}
+        for archive in sorted(archives, key=lambda a: a.manifest['created_at']):
+            newest[archive.manifest['group_id']] = archive
+        heads = list(newest.values())
+    chains = {}
+    for head in heads:
+        chain = [head]
+        while chain[-1].manifest['kind'] == DELTA:
+            previous = chain[-1].manifest['previous']
+            if previous not in by_stem:
+                logger.warning(f'{chain[-1].stem} continues {previous or "an archive without a manifest"}, which was not found; '
+                               f'messages before it are missing from the restore.')
+                break
+            chain.append(by_stem[previous])
+        chains[head.manifest['group_id']] = chain[::-1]
+    return chains
+
+
+def extract(archive, arcname, path):
+    """Copy an entry to path in chunks and return the SHA-256 of its content."""
+    digest = hashlib.sha256()
+    with archive.open(arcname) as src, open(path, 'wb') as dst:
+        for chunk in iter(lambda: src.read(COPY_BUFFER_SIZE), b''):
+            digest.update(chunk)
+            dst.write(chunk)
+    return digest.hexdigest()
+
+
+def claim_name(names, file_name):
+    root, ext = os.path.splitext(file_name)
+    name = file_name
+    i = 1
+    while name in names:
+        name = f"{root}({i}){ext}"
+        i += 1
+    names.add(name)
+    return name
+
+
+def restore_chain(chain, output_dir, page_size=PAGE_SIZE):
+    """
+    Apply a chain of archives, oldest first, into output_dir: media files under MEDIA_DIR
+    and one paged chat log of all messages. Returns (message count, media file count).
+    """
+    media_dir = os.path.join(output_dir, MEDIA_DIR)
+    os.makedirs(media_dir, exist_ok=True)
+    database_path = os.path.join(output_dir, DATABASE_NAME)
+    if os.path.exists(database_path):
+        os.remove(database_path)
+    db = sqlite3.connect(database_path)
+    try:
+        db.execute('CREATE TABLE messages (id INTEGER PRIMARY KEY, topic TEXT, sender TEXT, date TEXT, text TEXT, photo TEXT, document TEXT, note TEXT)')
+        # sha256 -> restored path, so a file shared by several archives is extracted once
+        restored = {}
+        names = set()
+        for archive in chain:
+            logger.info(f'Applying {archive.manifest["kind"]} archive {archive.stem}')
+            # arcname in this archive -> path relative to output_dir
+            media_paths = {}
+            for arcname, (msg_id, size, sha256) in archive.manifest['media'].items():
+                if sha256 and sha256 in restored:
+                    media_paths[arcname] = restored[sha256]
+                    continue
+                if arcname not in archive.entries:
+                    logger.warning(f'{arcname} of message {msg_id} is missing; is a volume of {archive.stem} missing?')
+                    continue
+                relative_path = f'{MEDIA_DIR}/{claim_name(names, os.path.basename(arcname))}'
+                digest = extract(archive, arcname, os.path.join(output_dir, relative_path))
+                if sha256 and digest != sha256:
+                    logger.warning(f'{arcname} in {archive.stem} does not match its manifest hash; the file may be damaged.')
+                restored[digest] = relative_path
+                media_paths[arcname] = relative_path
+
+            def rows(lines):
+                for line in lines:
+                    messages_digest.update(line)
+                    msg_id, topic, sender, date, text, photo, document, note = json.loads(line)
+                    if (photo and photo not in media_paths) or (document and document not in media_paths):
+                        note = note or 'Media missing from the restored archives'
+                    yield msg_id, topic, sender, date, text, media_paths.get(photo), media_paths.get(document), note
+
+            messages_digest = hashlib.sha256()
+            with archive.open(MESSAGES_NAME) as f:
+                db.executemany('INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows(f))
+            db.commit()
+            if messages_digest.hexdigest() != archive.manifest['messages_sha256']:
+                logger.warning(f'Message rows of {archive.stem} do not match their manifest hash.')
+        # Most recently active topics first, like the chat log of a single archive
+        topics = [
+            (topic, count, db.execute('SELECT sender, date, text, photo, document, note FROM messages WHERE topic = ? ORDER BY id DESC', (topic,)))
+            for topic, count in db.execute('SELECT topic, COUNT(*) FROM messages GROUP BY topic ORDER BY MAX(id) DESC').fetchall()
+        ]
+        title = chain[0].manifest.get('title') or 'Telegram Archive Backup'
+        write_chat_log(output_dir, title, topics, page_size)
+        message_count = sum(count for _, count, _ in topics)
+    finally:
+        db.close()
+        os.remove(database_path)
+    return message_count, len(restored)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Merge full and delta backup archives into one directory with a single chat log.')
+    arg_parser.add_argument('inputs', nargs='+', help='archive volumes, or directories holding them')
+    arg_parser.add_argument('-o', '--output', required=True, help='empty directory to restore into')
+    arg_parser.add_argument('-p', '--password', action='append', default=[], help='archive password; repeat for archives with different passwords')
+    arg_parser.add_argument('--until', help='restore the state as of this archive (e.g. archive_sync_1001_20240101_120000) instead of the newest one')
+    arg_parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help='messages per chat log page')
+    args = arg_parser.parse_args(argv)
+
+    if os.path.isdir(args.output) and os.listdir(args.output):
+        logger.error(f'{args.output} is not empty.')
+        return 1
+    passwords = args.password or [getpass.getpass('Archive password: ')]
+    try:
+        archives = open_archives(args.inputs, passwords)
+    except (ValueError, OSError, pyzipper.BadZipFile) as e:
+        logger.error(str(e))
+        return 1
+    try:
+        if not archives:
+            logger.error('No archives with a manifest found.')
+            return 1
+        try:
+            chains = find_chains(archives, until=args.until)
+        except ValueError as e:
+            logger.error(str(e))
+            return 1
+        for group_id, chain in chains.items():
+            # Several groups are restored side by side
+            output_dir = args.output if len(chains) == 1 else os.path.join(args.output, str(abs(group_id)))
+            os.makedirs(output_dir, exist_ok=True)
+            message_count, media_count = restore_chain(chain, output_dir, page_size=max(1, args.page_size))
+            logger.info(f'Restored {message_count} messages and {media_count} media files of group {group_id} '
+                        f'from {len(chain)} archive(s) into {output_dir}')
+    finally:
+        for archive in archives:
+            archive.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
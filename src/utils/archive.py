@@ -0,0 +1,135 @@
+import os
+import threading
+import pyzipper
+
+# Formats that are already compressed; deflating them again costs CPU for almost no gain
+COMPRESSED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif',
+    '.mp4', '.mkv', '.mov', '.avi', '.webm', '.m4v', '.3gp',
+    '.mp3', '.ogg', '.oga', '.opus', '.m4a', '.aac', '.flac',
+    '.zip', '.rar', '.7z', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.tgs',
+    '.apk', '.jar', '.docx', '.xlsx', '.pptx', '.odt', '.epub', '.pdf',
+}
+
+
+def get_compress_type(file_path):
+    """Store already-compressed media as-is and deflate everything else (chat log, text, etc.)."""
+    if os.path.splitext(file_path)[1].lower() in COMPRESSED_EXTENSIONS:
+        return pyzipper.ZIP_STORED
+    return pyzipper.ZIP_DEFLATED
+
+
+class ArchiveWriter:
+    """
+    Password-protected zip archive that files can be appended to one at a time,
+    so entries can be added while other backup stages are still running.
+    """
+
+    def __init__(self, zip_file_path, password, compresslevel=9):
+        self.zip_file_path = zip_file_path
+        self.zipf = pyzipper.AESZipFile(zip_file_path, 'w', compression=pyzipper.ZIP_DEFLATED, encryption=pyzipper.WZ_AES, compresslevel=compresslevel)
+        self.zipf.setpassword(password.encode())
+        self.archive_names = set()
+        # add() may be called from worker threads
+        self._lock = threading.Lock()
+
+    def get_unique_archive_name(self, base_name):
+        if base_name not in self.archive_names:
+            self.archive_names.add(base_name)
+            return base_name
+        root, ext = os.path.splitext(base_name)
+        i = 1
+        while True:
+            new_name = f"{root}({i}){ext}"
+            if new_name not in self.archive_names:
+                self.archive_names.add(new_name)
+                return new_name
+            i += 1
+
+    def add(self, file_path, arcname):
+        """
+        Write a file into the archive and return the name it was stored under.
+        This does blocking I/O and compression; call it from a worker thread in async code.
+        """
+        with self._lock:
+            arcname = self.get_unique_archive_name(arcname)
+            self.zipf.write(file_path, arcname, compress_type=get_compress_type(file_path))
+        return arcname
+
+    def size(self):
+        """Bytes written to the archive so far."""
+        with self._lock:
+            return self.zipf.fp.tell()
+
+    def close(self):
+        with self._lock:
+            self.zipf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class VolumeSet:
+    """
+    Splits an archive into self-contained encrypted zip volumes of at most max_volume_size bytes.
+    Each slot from open_slot() fills its own volume, so several volumes can be built at once on
+    worker threads. Without max_volume_size a single slot writes exactly base_path.
+    """
+
+    def __init__(self, base_path, password, max_volume_size=None, compresslevel=9, first_volume=0):
+        self.base_path = base_path
+        self.password = password
+        self.max_volume_size = max_volume_size
+        self.compresslevel = compresslevel
+        # Numbering continues after first_volume, e.g. when resuming an interrupted job
+        self._volume_count = first_volume
+        self._lock = threading.Lock()
+
+    def next_volume_path(self):
+        if not self.max_volume_size:
+            return self.base_path
+        with self._lock:
+            self._volume_count += 1
+            root, ext = os.path.splitext(self.base_path)
+            return f"{root}.part{self._volume_count:03d}{ext}"
+
+    def open_slot(self):
+        return VolumeSlot(self)
+
+
+class VolumeSlot:
+    """One volume under construction; rolls over to a new volume when the size limit is reached."""
+
+    # Room left for local headers and the central directory of each entry
+    ENTRY_OVERHEAD = 1024
+
+    def __init__(self, volume_set):
+        self.volume_set = volume_set
+        self.writer = None
+
+    def add(self, file_path, arcname):
+        """
+        Add a file to the current volume, sealing it first if the file would not fit.
+        Returns the path of the volume that was sealed to make room, or None.
+        Blocking; call it from a worker thread in async code.
+        """
+        sealed = None
+        max_size = self.volume_set.max_volume_size
+        if self.writer and max_size and self.writer.archive_names:
+            if self.writer.size() + os.path.getsize(file_path) + self.ENTRY_OVERHEAD > max_size:
+                sealed = self.close()
+        if self.writer is None:
+            self.writer = ArchiveWriter(self.volume_set.next_volume_path(), self.volume_set.password, compresslevel=self.volume_set.compresslevel)
+        self.writer.add(file_path, arcname)
+        return sealed
+
+    def close(self):
+        """Seal the current volume and return its path, or None if nothing was written."""
+        if self.writer is None:
+            return None
+        writer, self.writer = self.writer, None
+        writer.close()
+        return writer.zip_file_path
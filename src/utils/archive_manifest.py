@@ -0,0 +1,73 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+
+MANIFEST_NAME = 'archive_manifest.json'
+MESSAGES_NAME = 'messages.jsonl'
+FORMAT_VERSION = 1
+# A full archive holds a group's whole history; a delta holds the messages after its previous archive
+FULL, DELTA = 'full', 'delta'
+HASH_CHUNK_SIZE = 1024 * 1024
+VOLUME_SUFFIX = re.compile(r'(\.part\d+)?\.zip$')
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def archive_stem(zip_file_path):
+    """Name shared by all volumes of an archive, e.g. archive_sync_1001_20240101_120000."""
+    return VOLUME_SUFFIX.sub('', os.path.basename(zip_file_path))
+
+
+def id_ranges(ids):
+    """Sorted [first, last] runs of consecutive message ids, to keep the manifest small."""
+    ranges = []
+    for msg_id in sorted(ids):
+        if ranges and msg_id == ranges[-1][1] + 1:
+            ranges[-1][1] = msg_id
+        else:
+            ranges.append([msg_id, msg_id])
+    return ranges
+
+
+def write_archive_manifest(output_dir, archive, kind, group_id, title, previous, rows, media):
+    """
+    Write MESSAGES_NAME and MANIFEST_NAME into output_dir.
+    rows yields (msg_id, topic_name, sender_name, date_str, text, photo, document, note),
+    the chat log rows with their message id and topic, and is written one JSON array per
+    line. media maps each media arcname to (msg_id, size, sha256). previous is the stem
+    of the archive a delta continues, or None.
+    Returns (path, arcname) for both files.
+    """
+    messages_path = os.path.join(output_dir, MESSAGES_NAME)
+    ids = []
+    digest = hashlib.sha256()
+    with open(messages_path, 'wb') as f:
+        for row in rows:
+            ids.append(row[0])
+            line = json.dumps(row, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+            digest.update(line)
+            f.write(line)
+    manifest = {
+        'format': FORMAT_VERSION,
+        'archive': archive,
+        'kind': kind,
+        'group_id': group_id,
+        'title': title,
+        'previous': previous,
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'message_ids': id_ranges(ids),
+        'messages_sha256': digest.hexdigest(),
+        'media': {arcname: list(info) for arcname, info in media.items()},
+    }
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'))
+    return [(messages_path, MESSAGES_NAME), (manifest_path, MANIFEST_NAME)]
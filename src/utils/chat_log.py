@@ -0,0 +1,287 @@
+import html
+import math
+import os
+import re
+
+INDEX_NAME = 'chat_log.html'
+# Topic pages are stored under this directory next to the index
+PAGES_DIR = 'chat_log'
+PAGE_SIZE = 1000
+WRITE_BUFFER_SIZE = 64 * 1024
+
+# One pass over the text: a URL to link, or a character to escape
+TEXT_TOKENS = re.compile(r'(https?://[^\s<>"]+|www\.[^\s<>"]+)|[&<>"\'\n]')
+TEXT_ESCAPES = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#x27;', '\n': '<br>'}
+
+STYLE = '''
+        body {
+            font-family: 'Inter', Arial, sans-serif;
+            background: linear-gradient(120deg, #e0e7ff 0%, #f5f7fa 100%);
+            margin: 0;
+            margin-inline: 12px;
+            padding: 0;
+            min-height: 100vh;
+        }
+        .chat-container {
+            max-width: 900px;
+            margin: 48px auto;
+            background: #fff;
+            border-radius: 18px;
+            box-shadow: 0 6px 32px rgba(60,72,88,0.13);
+            padding: 36px 32px 32px 32px;
+            overflow: hidden;
+        }
+        h2 {
+            text-align: center;
+            font-weight: 600;
+            color: #2a5885;
+            margin-bottom: 32px;
+            letter-spacing: 1px;
+        }
+        .chat-log {
+            margin-top: 0;
+        }
+        .topic-section {
+            margin-top: 40px;
+            border-radius: 12px;
+            background: #f7faff;
+            box-shadow: 0 1px 4px rgba(60,72,88,0.07);
+            padding: 0 0 12px 0;
+        }
+        .topic-header {
+            display: flex;
+            align-items: center;
+            justify-content: space-between;
+            background: #e3eaff;
+            border-radius: 12px 12px 0 0;
+            padding: 16px 24px;
+            cursor: pointer;
+            font-size: 1.15em;
+            font-weight: 600;
+            color: #2a5885;
+            transition: background 0.2s;
+        }
+        .topic-header:hover {
+            background: #d0e2ff;
+        }
+        .topic-count {
+            background: #2a5885;
+            color: #fff;
+            border-radius: 8px;
+            padding: 2px 10px;
+            font-size: 0.95em;
+            margin-left: 12px;
+        }
+        .topic-content {
+            display: none;
+            padding: 18px 24px 0 24px;
+        }
+        .topic-content iframe {
+            width: 100%;
+            height: 75vh;
+            border: none;
+        }
+        .msg {
+            margin-bottom: 28px;
+            padding-bottom: 12px;
+            border-bottom: 1px solid #e3eaff;
+            background: #fff;
+            border-radius: 8px;
+            box-shadow: 0 1px 2px rgba(60,72,88,0.04);
+            padding: 18px 18px 12px 18px;
+            transition: box-shadow 0.2s;
+        }
+        .msg:last-child {
+            border-bottom: none;
+        }
+        .sender {
+            font-weight: 600;
+            color: #2a5885;
+            font-size: 1.08em;
+        }
+        .date {
+            font-size: 0.93em;
+            color: #7a8599;
+            margin-left: 10px;
+        }
+        .text {
+            margin: 10px 0 0 0;
+            font-size: 1.07em;
+            color: #222b45;
+            line-height: 1.6;
+            word-break: break-word;
+        }
+        .media {
+            color: #d2691e;
+            font-style: italic;
+            margin-top: 10px;
+        }
+        .media img {
+            max-width: 340px;
+            max-height: 340px;
+            border-radius: 10px;
+            box-shadow: 0 2px 8px rgba(60,72,88,0.13);
+            margin: 10px 0;
+            display: block;
+        }
+        .media .placeholder {
+            display: inline-block;
+            border: 1px dashed #b8c4dd;
+            border-radius: 8px;
+            padding: 6px 12px;
+            color: #7a8599;
+        }
+        .media a, .pager a {
+            color: #2a5885;
+            text-decoration: underline;
+            font-weight: 500;
+        }
+        .pager {
+            display: flex;
+            justify-content: space-between;
+            margin: 12px 0 24px 0;
+            color: #7a8599;
+        }
+        @media (max-width: 600px) {
+            .chat-container { padding: 10px; }
+            .topic-header, .topic-content { padding: 10px; }
+            .msg { padding: 10px; }
+        }
+        .toggle-icon {
+            font-size: 1.2em;
+            margin-left: 8px;
+            transition: transform 0.2s;
+        }
+        .topic-header.open .toggle-icon {
+            transform: rotate(90deg);
+        }
+'''
+
+# Pages are loaded into the section's frame the first time it is opened
+TOGGLE_SCRIPT = '''<script>
+function toggleTopic(id) {
+  var header = document.getElementById('header_' + id);
+  var content = document.getElementById(id);
+  if (content.style.display === "none" || content.style.display === "") {
+    if (!content.firstChild) {
+      var frame = document.createElement('iframe');
+      frame.src = content.getAttribute('data-src');
+      content.appendChild(frame);
+    }
+    content.style.display = "block";
+    header.classList.add('open');
+  } else {
+    content.style.display = "none";
+    header.classList.remove('open');
+  }
+}
+</script>'''
+
+FOOTER = '</div></div></body></html>'
+
+
+def _replace_token(match):
+    url = match.group(1)
+    if url is None:
+        return TEXT_ESCAPES[match.group(0)]
+    escaped = html.escape(url)
+    href = escaped if url.startswith('http') else 'http://' + escaped
+    return f'<a href="{href}" target="_blank">{escaped}</a>'
+
+
+def render_text(text):
+    """Escape message text, turn URLs into links and newlines into <br>."""
+    return TEXT_TOKENS.sub(_replace_token, text)
+
+
+def _header(page_title, heading):
+    return f'''<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>{page_title}</title>
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;600&display=swap" rel="stylesheet">
+    <style>{STYLE}    </style>
+</head>
+<body>
+<div class="chat-container">
+<h2>{heading}</h2>
+<div class="chat-log">
+'''
+
+
+def page_name(topic_number, page_number):
+    return f'topic_{topic_number}_{page_number}.html'
+
+
+def _pager(topic_number, page_number, page_count):
+    previous_link = f'<a href="{page_name(topic_number, page_number - 1)}">&laquo; Previous</a>' if page_number > 1 else '<span></span>'
+    next_link = f'<a href="{page_name(topic_number, page_number + 1)}">Next &raquo;</a>' if page_number < page_count else '<span></span>'
+    return f'<div class="pager">{previous_link}<span>Page {page_number} of {page_count}</span>{next_link}</div>'
+
+
+def _render_message(row, media_prefix):
+    sender_name, date_str, text, photo, document, note = row
+    parts = ['<div class="msg">', f'<span class="sender">{html.escape(sender_name)}</span>', f'<span class="date">{date_str}</span>']
+    if text:
+        parts.append(f'<div class="text">{render_text(text)}</div>')
+    if photo:
+        parts.append(f'<div class="media"><img src="{html.escape(media_prefix + photo)}" alt="Photo" /></div>')
+    if document:
+        parts.append(f'<div class="media">[<a href="{html.escape(media_prefix + document)}" target="_blank">{html.escape(os.path.basename(document))}</a>]</div>')
+    if note:
+        parts.append(f'<div class="media"><span class="placeholder">{html.escape(note)}</span></div>')
+    parts.append('</div>')
+    return ''.join(parts)
+
+
+def write_chat_log(output_dir, title, topics, page_size=PAGE_SIZE):
+    """
+    Write the chat log into output_dir: INDEX_NAME with one collapsible section per topic,
+    and the messages of each topic in pages of page_size under PAGES_DIR. A section loads
+    its pages only when it is opened, so the index stays small for any history size.
+    topics is a list of (topic_name, message_count, rows) where rows yields
+    (sender_name, date_str, text, photo, document, note) tuples; photo and document are
+    archive-relative media paths or None, and note is placeholder text for media that
+    was not archived in full. Rows are consumed one at a time, so only the
+    page being written is held in memory.
+    Returns (path, arcname) for every file written, the index first.
+    """
+    pages_dir = os.path.join(output_dir, PAGES_DIR)
+    os.makedirs(pages_dir, exist_ok=True)
+    index_path = os.path.join(output_dir, INDEX_NAME)
+    files = [(index_path, INDEX_NAME)]
+    # Pages live one directory below the archive root
+    media_prefix = '../'
+    safe_title = html.escape(title)
+    with open(index_path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as index:
+        index.write(_header(safe_title, safe_title))
+        index.write(TOGGLE_SCRIPT)
+        for topic_number, (topic_name, message_count, rows) in enumerate(topics):
+            topic_div_id = f'topic_{topic_number}'
+            safe_topic = html.escape(topic_name)
+            page_count = max(1, math.ceil(message_count / page_size))
+            index.write(
+                f'<div class="topic-section">'
+                f'<div class="topic-header" id="header_{topic_div_id}" onclick="toggleTopic(\'{topic_div_id}\')">'
+                f'<div><span>{safe_topic}</span><span class="topic-count">{message_count}</span></div>'
+                f'<span class="toggle-icon">&#9654;</span></div>'
+                f'<div class="topic-content" id="{topic_div_id}" data-src="{PAGES_DIR}/{page_name(topic_number, 1)}"></div>'
+                f'</div>'
+            )
+            rows = iter(rows)
+            for page_number in range(1, page_count + 1):
+                name = page_name(topic_number, page_number)
+                path = os.path.join(pages_dir, name)
+                with open(path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as page:
+                    page.write(_header(f'{safe_title} - {safe_topic}', safe_topic))
+                    pager = _pager(topic_number, page_number, page_count)
+                    page.write(pager)
+                    for _, row in zip(range(page_size), rows):
+                        page.write(_render_message(row, media_prefix))
+                    page.write(pager)
+                    page.write(FOOTER)
+                files.append((path, f'{PAGES_DIR}/{name}'))
+        index.write(FOOTER)
+    return files
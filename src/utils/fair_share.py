@@ -0,0 +1,68 @@
+import asyncio
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+
+
+class FairShare:
+    """
+    Semaphore of limit slots shared between groups of callers. A freed slot goes to the
+    waiting group that holds the fewest slots, rotating between groups on ties, so a group
+    with a long backlog cannot starve the others.
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self.in_use = 0
+        # group -> slots held
+        self.held = defaultdict(int)
+        # group -> futures of waiting callers, in arrival order
+        self.waiting = {}
+
+    @asynccontextmanager
+    async def slot(self, group):
+        await self._acquire(group)
+        try:
+            yield
+        finally:
+            self._release(group)
+
+    def _grant(self, group):
+        self.in_use += 1
+        self.held[group] += 1
+
+    async def _acquire(self, group):
+        if self.in_use < self.limit and not self.waiting:
+            self._grant(group)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(group, deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just before the cancellation; hand it on
+                self._release(group)
+            else:
+                queue = self.waiting.get(group)
+                if queue and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self.waiting[group]
+            raise
+
+    def _release(self, group):
+        self.in_use -= 1
+        self.held[group] -= 1
+        if not self.held[group]:
+            del self.held[group]
+        while self.in_use < self.limit and self.waiting:
+            # min() keeps the first of equals; re-queueing the chosen group at the end rotates ties
+            group = min(self.waiting, key=lambda g: self.held.get(g, 0))
+            queue = self.waiting.pop(group)
+            waiter = queue.popleft()
+            if queue:
+                self.waiting[group] = queue
+            if waiter.done():
+                continue
+            self._grant(group)
+            waiter.set_result(None)
@@ -0,0 +1,71 @@
+import asyncio
+import copy
+import math
+import os
+from telethon.helpers import generate_random_long
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.help import GetConfigRequest
+from telethon.tl.functions.upload import SaveBigFilePartRequest
+from telethon.tl.types import InputFileBig
+
+# Largest part size Telegram accepts for file uploads
+PART_SIZE = 512 * 1024
+# Telegram only accepts big-file (SaveBigFilePart) uploads above this size
+BIG_FILE_MIN_SIZE = 10 * 1024 * 1024
+
+
+async def _create_sender(client):
+    """Open an extra connection to the home DC that reuses the session's auth key."""
+    dc = await client._get_dc(client.session.dc_id)
+    sender = MTProtoSender(client.session.auth_key, loggers=client._log)
+    await sender.connect(client._connection(dc.ip_address, dc.port, dc.id, loggers=client._log, proxy=client._proxy))
+    try:
+        init_request = copy.copy(client._init_request)
+        init_request.query = GetConfigRequest()
+        await sender.send(InvokeWithLayerRequest(LAYER, init_request))
+    except BaseException:
+        await sender.disconnect()
+        raise
+    return sender
+
+
+async def upload_file_parallel(client, file_path, connections=4, progress_callback=None, flood_control=None):
+    """
+    Upload a big file to Telegram over several connections at once and return the
+    InputFileBig handle to pass to send_file. Parts are handed out from a shared
+    counter, so a slow connection never holds up the others. The extra connections
+    bypass the client, so parts are sent through flood_control when it is given.
+    """
+    file_size = os.path.getsize(file_path)
+    if file_size <= BIG_FILE_MIN_SIZE:
+        raise ValueError(f'{file_path} is too small for a parallel upload')
+    file_id = generate_random_long()
+    part_count = math.ceil(file_size / PART_SIZE)
+    parts = iter(range(part_count))
+    uploaded = 0
+
+    async def upload_parts(sender):
+        nonlocal uploaded
+        with open(file_path, 'rb') as f:
+            for part_index in parts:
+                f.seek(part_index * PART_SIZE)
+                data = f.read(PART_SIZE)
+                request = SaveBigFilePartRequest(file_id, part_index, part_count, data)
+                if not await (flood_control.call(sender.send, request) if flood_control else sender.send(request)):
+                    raise RuntimeError(f'Telegram rejected part {part_index} of {file_path}')
+                uploaded += len(data)
+                if progress_callback:
+                    progress_callback(uploaded, file_size)
+
+    results = await asyncio.gather(*(_create_sender(client) for _ in range(max(1, connections))), return_exceptions=True)
+    senders = [r for r in results if isinstance(r, MTProtoSender)]
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors and not senders:
+        raise errors[0]
+    try:
+        await asyncio.gather(*(upload_parts(sender) for sender in senders))
+    finally:
+        await asyncio.gather(*(sender.disconnect() for sender in senders), return_exceptions=True)
+    return InputFileBig(file_id, part_count, os.path.basename(file_path))
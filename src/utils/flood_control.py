@@ -0,0 +1,103 @@
+import asyncio
+import time
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+from utils.colorlog import logger
+
+
+class AdaptiveConcurrency:
+    """
+    Limits how many Telegram requests run at once and adapts the limit to the account's
+    rate limits. Every successful request raises the limit by 1/limit, about one more
+    slot per round of requests; a FloodWait halves it and holds all requests until the
+    wait is over, then retries the request. Waits longer than max_wait are raised.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16, max_wait=3600, on_flood_wait=None):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.max_wait = max_wait
+        # Called with the seconds each FloodWait added to the time requests were held
+        self.on_flood_wait = on_flood_wait
+        self.active = 0
+        self.paused_until = 0.0
+        self.flood_waits = 0
+        self.throttled_seconds = 0.0
+        self._waiters = []
+
+    async def _acquire(self):
+        while True:
+            delay = self.paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            if self.active < int(self.limit):
+                self.active += 1
+                return
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def _release(self, succeeded):
+        self.active -= 1
+        if succeeded:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _hold(self, seconds):
+        now = time.monotonic()
+        until = now + seconds
+        self.flood_waits += 1
+        if until <= self.paused_until:
+            return
+        added = until - max(now, self.paused_until)
+        if self.paused_until <= now:
+            # Halve once per throttling episode, not for every request that runs into it
+            self.limit = max(self.minimum, self.limit / 2)
+        self.paused_until = until
+        self.throttled_seconds += added
+        logger.warning(f'Telegram FloodWait of {seconds}s; holding requests, concurrency limit now {int(self.limit)}')
+        if self.on_flood_wait:
+            self.on_flood_wait(added)
+
+    async def call(self, func, *args, **kwargs):
+        """Await func(*args, **kwargs) within the limit, retrying it after FloodWaits."""
+        while True:
+            await self._acquire()
+            succeeded = False
+            try:
+                result = await func(*args, **kwargs)
+                succeeded = True
+                return result
+            except FloodWaitError as e:
+                if e.seconds > self.max_wait:
+                    raise
+                self._hold(e.seconds)
+            finally:
+                self._release(succeeded)
+
+
+class ThrottledTelegramClient(TelegramClient):
+    """
+    TelegramClient that sends every request through an AdaptiveConcurrency controller.
+    Telethon's own FloodWait sleeping is turned off, so each wait reaches the controller
+    and is counted there. Takeout sessions proxy their requests through here as well.
+    """
+
+    def __init__(self, *args, flood_control=None, **kwargs):
+        # Telethon checks this attribute, not the _call argument, before sleeping on its own
+        kwargs['flood_sleep_threshold'] = 0
+        super().__init__(*args, **kwargs)
+        self.flood_control = flood_control or AdaptiveConcurrency()
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        # self may be a takeout proxy, which rules out zero-argument super()
+        return await self.flood_control.call(TelegramClient._call, self, sender, request, ordered=ordered, flood_sleep_threshold=0)
@@ -0,0 +1,136 @@
+import json
+import os
+
+# Recorded for deliveries journaled without a destination
+ALL_DESTINATIONS = '*'
+
+
+class BackupJournal:
+    """
+    Append-only JSON-lines record of a running backup job. It notes which message range
+    was fetched, which media finished downloading and which archive volumes were built and
+    delivered, so a rerun after a crash can continue where the last run stopped.
+    The file is removed once the job completes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.reset()
+        self.load()
+
+    def reset(self):
+        self.job = None
+        # Contiguous range of message ids (newest, oldest) already written to the message index
+        self.fetched = None
+        # Newest message id once the whole fetch has finished
+        self.newest_id = None
+        # message id -> (path, size, note, sha256) of finished downloads
+        self.media = {}
+        # volume path -> {'media_ids', 'chat_log', 'delivered', 'failures'}; delivered holds the
+        # destinations that received the volume, failures counts failed attempts per destination
+        self.volumes = {}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash can leave the last line half-written
+                    break
+                self._apply(record)
+
+    def _apply(self, record):
+        kind = record['type']
+        if kind == 'start':
+            self.reset()
+            self.job = record
+        elif kind == 'fetched':
+            self.fetched = (record['newest_id'], record['oldest_id'])
+        elif kind == 'fetch_done':
+            self.newest_id = record['newest_id']
+        elif kind == 'media':
+            self.media[record['msg_id']] = (record['path'], record['size'], record.get('note'), record.get('sha256'))
+        elif kind == 'volume':
+            self.volumes[record['path']] = {'media_ids': set(record['media_ids']), 'chat_log': record['chat_log'], 'delivered': set(), 'failures': {}}
+        elif kind == 'delivered':
+            if record['path'] in self.volumes:
+                # Journals from before destinations were recorded mark a volume delivered everywhere
+                self.volumes[record['path']]['delivered'].add(record.get('destination', ALL_DESTINATIONS))
+        elif kind == 'delivery_failed':
+            if record['path'] in self.volumes:
+                failures = self.volumes[record['path']]['failures']
+                failures[record['destination']] = failures.get(record['destination'], 0) + 1
+
+    def _append(self, record):
+        self._apply(record)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def resumable_job(self, zip_prefix):
+        """The unfinished job with this zip prefix, or None."""
+        if self.job and self.job['zip_prefix'] == zip_prefix:
+            return self.job
+        return None
+
+    def start(self, zip_prefix, zip_file_path, min_id, password):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._append({'type': 'start', 'zip_prefix': zip_prefix, 'zip_file_path': zip_file_path, 'min_id': min_id, 'password': password})
+
+    def record_fetched(self, newest_id, oldest_id):
+        self._append({'type': 'fetched', 'newest_id': newest_id, 'oldest_id': oldest_id})
+
+    def record_fetch_done(self, newest_id):
+        self._append({'type': 'fetch_done', 'newest_id': newest_id})
+
+    def record_media(self, msg_id, path, size, note=None, sha256=None):
+        self._append({'type': 'media', 'msg_id': msg_id, 'path': path, 'size': size, 'note': note, 'sha256': sha256})
+
+    def record_volume(self, path, media_ids, chat_log=False):
+        self._append({'type': 'volume', 'path': path, 'media_ids': sorted(media_ids), 'chat_log': chat_log})
+
+    def record_delivered(self, path, destination):
+        self._append({'type': 'delivered', 'path': path, 'destination': destination})
+
+    def record_delivery_failed(self, path, destination):
+        self._append({'type': 'delivery_failed', 'path': path, 'destination': destination})
+
+    def finished_media(self, msg_id):
+        """Path of a download recorded for msg_id if the file is still complete on disk."""
+        entry = self.media.get(msg_id)
+        if entry and os.path.exists(entry[0]) and os.path.getsize(entry[0]) == entry[1]:
+            return entry[0]
+        return None
+
+    def archived_media_ids(self):
+        """Message ids whose media is already inside a sealed volume."""
+        ids = set()
+        for volume in self.volumes.values():
+            ids |= volume['media_ids']
+        return ids
+
+    def has_chat_log_volume(self):
+        return any(volume['chat_log'] for volume in self.volumes.values())
+
+    def delivered_to(self, path):
+        """Destinations a volume was delivered to."""
+        return self.volumes[path]['delivered'] if path in self.volumes else set()
+
+    def missing_destinations(self, path, destinations):
+        """The given destinations that have not received a volume yet."""
+        delivered = self.delivered_to(path)
+        if ALL_DESTINATIONS in delivered:
+            return []
+        return [destination for destination in destinations if destination not in delivered]
+
+    def delivery_attempts(self, path):
+        """Most failed attempts to deliver a volume to any one destination."""
+        failures = self.volumes[path]['failures'] if path in self.volumes else {}
+        return max(failures.values(), default=0)
+
+    def undelivered_volumes(self, destinations):
+        """Volumes still on disk that some of the given destinations have not received."""
+        return [path for path in self.volumes if self.missing_destinations(path, destinations) and os.path.exists(path)]
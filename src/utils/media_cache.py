@@ -0,0 +1,127 @@
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+
+def get_media_key(message):
+    """Stable identity of a message's photo or document, shared by forwards and re-posts."""
+    stored_key = getattr(message, 'media_key', None)
+    if stored_key:
+        return stored_key
+    media = message.photo or message.document
+    if media is None or getattr(media, 'id', None) is None:
+        return None
+    kind = 'photo' if message.photo else 'document'
+    return f"{kind}_{media.id}_{getattr(media, 'access_hash', 0)}"
+
+
+def link_or_copy(src, dest):
+    """Hard-link src to dest, copying when the filesystem does not allow links."""
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+class MediaCache:
+    """
+    Persistent store of downloaded media keyed by Telegram file identity.
+    Entries are kept in least-recently-used order and evicted once the total size
+    exceeds max_size bytes. Files are shared with backup workspaces through hard links,
+    so removing a workspace never touches the cache.
+    """
+
+    INDEX_NAME = 'index.json'
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.index_path = os.path.join(cache_dir, self.INDEX_NAME)
+        # key -> {'file': name inside cache_dir, 'size': bytes}
+        self.entries = OrderedDict()
+        self.total_size = 0
+        self._lock = threading.Lock()
+        # Jobs of different groups save at the same time; they share the temporary file
+        self._save_lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except Exception:
+            return
+        for key, entry in entries:
+            if os.path.exists(os.path.join(self.cache_dir, entry['file'])):
+                self.entries[key] = entry
+                self.total_size += entry['size']
+
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                data = list(self.entries.items())
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.index_path)
+
+    def get(self, key):
+        """Path of the cached file for key, or None. Marks the entry as recently used."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return os.path.join(self.cache_dir, entry['file'])
+
+    def put(self, key, file_path):
+        """Add a downloaded file to the cache and evict old entries if over the size cap."""
+        size = os.path.getsize(file_path)
+        if size > self.max_size:
+            return
+        name = key + os.path.splitext(file_path)[1]
+        cache_path = os.path.join(self.cache_dir, name)
+        with self._lock:
+            if key in self.entries:
+                return
+        # The copy can take a while on another filesystem, so it is made outside the lock
+        # under a name of this thread's own and moved into place under it
+        tmp_path = f'{cache_path}.{threading.get_ident()}.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        link_or_copy(file_path, tmp_path)
+        with self._lock:
+            if key in self.entries:
+                os.remove(tmp_path)
+                return
+            os.replace(tmp_path, cache_path)
+            self.entries[key] = {'file': name, 'size': size}
+            self.total_size += size
+            while self.total_size > self.max_size and self.entries:
+                _, old = self.entries.popitem(last=False)
+                self.total_size -= old['size']
+                try:
+                    os.remove(os.path.join(self.cache_dir, old['file']))
+                except OSError:
+                    pass
+
+    def restore(self, key, file_path):
+        """
+        Place the cached file for key at file_path. If file_path has no extension the
+        cached file's extension is added. Returns the written path, or None on a miss.
+        """
+        cache_path = self.get(key)
+        if cache_path is None:
+            return None
+        if not os.path.splitext(file_path)[1]:
+            file_path += os.path.splitext(cache_path)[1]
+        try:
+            link_or_copy(cache_path, file_path)
+        except OSError:
+            return None
+        return file_path
@@ -0,0 +1,73 @@
+import os
+import threading
+
+
+class MediaEntry:
+    __slots__ = ('path', 'size', 'arcname', 'note', 'sha256')
+
+    def __init__(self, path, size, arcname, note=None, sha256=None):
+        self.path = path
+        self.size = size
+        self.arcname = arcname
+        # Set when the file stands in for the original, e.g. a thumbnail
+        self.note = note
+        # Hex digest of the file, for the archive manifest
+        self.sha256 = sha256
+
+
+class MediaManifest:
+    """
+    In-memory record of the media downloaded for one backup: message id -> path on disk,
+    size and name inside the archive. File names are reserved here before a download
+    starts, so the download, chat log and zip stages agree on names without probing
+    the filesystem. Media left out by the media policy is recorded with the reason, so
+    the chat log can show a placeholder for it.
+    """
+
+    def __init__(self, media_dir, arc_dir='media'):
+        self.media_dir = media_dir
+        self.arc_dir = arc_dir
+        self.entries = {}
+        # msg_id -> placeholder text of media that was not downloaded
+        self.skipped = {}
+        self._names = set()
+        # Downloads run concurrently and the zip stage reads from worker threads
+        self._lock = threading.Lock()
+
+    def claim(self, file_name):
+        """Reserve a file name in media_dir, adding (1), (2), ... on collisions, and return its path."""
+        root, ext = os.path.splitext(file_name)
+        with self._lock:
+            name = file_name
+            i = 1
+            while name in self._names:
+                name = f"{root}({i}){ext}"
+                i += 1
+            self._names.add(name)
+        return os.path.join(self.media_dir, name)
+
+    def add(self, msg_id, file_path, size=None, note=None, sha256=None):
+        """Record the finished file of a message. size is read from disk when not given."""
+        if size is None:
+            size = os.path.getsize(file_path)
+        name = os.path.basename(file_path)
+        entry = MediaEntry(file_path, size, f"{self.arc_dir}/{name}", note, sha256)
+        with self._lock:
+            self._names.add(name)
+            self.entries[msg_id] = entry
+        return entry
+
+    def skip(self, msg_id, note):
+        with self._lock:
+            self.skipped[msg_id] = note
+
+    def get_skipped(self, msg_id):
+        with self._lock:
+            return self.skipped.get(msg_id)
+
+    def get(self, msg_id):
+        with self._lock:
+            return self.entries.get(msg_id)
+
+    def __len__(self):
+        return len(self.entries)
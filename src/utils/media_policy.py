@@ -0,0 +1,120 @@
+from telethon.tl.types import PhotoCachedSize, PhotoSize, PhotoStrippedSize
+
+MB = 1024 * 1024
+MEDIA_KINDS = ('photo', 'video', 'audio', 'voice', 'sticker', 'document')
+FULL, THUMB, SKIP = 'full', 'thumb', 'skip'
+MODES = (FULL, THUMB, SKIP)
+# Longest side of the thumbnail picked for THUMB; Telegram's 'm' size is 320 px
+THUMB_MAX_SIDE = 320
+
+
+def media_kind(message):
+    """Media type of a message as used in the policy, or None without downloadable media."""
+    if message.photo:
+        return 'photo'
+    if not message.document:
+        return None
+    if getattr(message, 'sticker', None):
+        return 'sticker'
+    if getattr(message, 'voice', None) or getattr(message, 'video_note', None):
+        return 'voice'
+    if getattr(message, 'video', None) or getattr(message, 'gif', None):
+        return 'video'
+    if getattr(message, 'audio', None):
+        return 'audio'
+    return 'document'
+
+
+def select_thumbnail(message):
+    """
+    The largest thumbnail of the message's photo or document that fits in THUMB_MAX_SIDE,
+    else the smallest one with known dimensions, else the inline stripped preview.
+    Returns None if Telegram has no thumbnail for it.
+    """
+    media = message.photo or message.document
+    sizes = (getattr(media, 'sizes', None) if message.photo else getattr(media, 'thumbs', None)) or []
+    sized = sorted((s for s in sizes if isinstance(s, (PhotoSize, PhotoCachedSize))), key=lambda s: max(s.w, s.h))
+    fitting = [s for s in sized if max(s.w, s.h) <= THUMB_MAX_SIDE]
+    if fitting:
+        return fitting[-1]
+    if sized:
+        return sized[0]
+    return next((s for s in sizes if isinstance(s, PhotoStrippedSize)), None)
+
+
+def format_size(size):
+    return f'{size / MB:.1f} MB' if size >= MB / 10 else f'{max(1, round(size / 1024))} KB'
+
+
+def _parse_mime_types(value):
+    return tuple(t.strip().lower() for t in value.split(',') if t.strip())
+
+
+def _mime_matches(mime_type, patterns):
+    # 'video/' matches every video type, anything else must match exactly
+    return any(mime_type.startswith(p) if p.endswith('/') else mime_type == p for p in patterns)
+
+
+class MediaPolicy:
+    """
+    Decides per message whether its media is downloaded in full, as Telegram's thumbnail
+    only, or skipped. Each media kind has a mode; files above the kind's size limit get
+    the oversize mode instead, and MIME type lists can exclude files altogether.
+    """
+
+    def __init__(self, modes=None, max_sizes=None, oversize=THUMB, allowed_mime_types=(), skipped_mime_types=()):
+        # kind -> mode and kind -> size limit in bytes (None = no limit)
+        self.modes = modes or {}
+        self.max_sizes = max_sizes or {}
+        self.oversize = oversize
+        self.allowed_mime_types = allowed_mime_types
+        self.skipped_mime_types = skipped_mime_types
+
+    @classmethod
+    def from_config(cls, parser, section, base_section=None):
+        """
+        Read a policy from a config section. Options missing there are taken from
+        base_section, so a job-specific section only needs the options it changes.
+        """
+        def get(option, fallback):
+            if base_section:
+                fallback = parser.get(base_section, option, fallback=fallback)
+            return parser.get(section, option, fallback=fallback).strip()
+
+        def get_mode(option, fallback, allowed=MODES):
+            mode = get(option, fallback).lower()
+            if mode not in allowed:
+                raise ValueError(f'[{section}] {option} must be one of {", ".join(allowed)}, not {mode!r}')
+            return mode
+
+        default_max_size = float(get('MAX_SIZE_MB', '0'))
+        modes, max_sizes = {}, {}
+        for kind in MEDIA_KINDS:
+            modes[kind] = get_mode(kind.upper(), FULL)
+            max_size_mb = float(get(f'{kind.upper()}_MAX_SIZE_MB', str(default_max_size)))
+            max_sizes[kind] = int(max_size_mb * MB) if max_size_mb > 0 else None
+        return cls(
+            modes=modes,
+            max_sizes=max_sizes,
+            oversize=get_mode('OVERSIZE', THUMB, allowed=(THUMB, SKIP)),
+            allowed_mime_types=_parse_mime_types(get('ALLOWED_MIME_TYPES', '')),
+            skipped_mime_types=_parse_mime_types(get('SKIPPED_MIME_TYPES', '')),
+        )
+
+    def decide(self, message):
+        """Return (mode, reason) for the message's media; reason is None for FULL."""
+        kind = media_kind(message)
+        mode = self.modes.get(kind, FULL)
+        if mode == SKIP:
+            return SKIP, f'{kind}s set to skip'
+        mime_type = (getattr(message.file, 'mime_type', None) or '').lower()
+        if mime_type and ((self.allowed_mime_types and not _mime_matches(mime_type, self.allowed_mime_types))
+                          or _mime_matches(mime_type, self.skipped_mime_types)):
+            return SKIP, f'{mime_type} excluded'
+        max_size = self.max_sizes.get(kind)
+        size = getattr(message.file, 'size', None) or 0
+        if mode == FULL and max_size and size > max_size:
+            return self.oversize, f'larger than {format_size(max_size)}'
+        if mode == THUMB:
+            return THUMB, f'{kind}s set to thumbnails'
+        return FULL, None
@@ -0,0 +1,166 @@
+import datetime
+import sqlite3
+import threading
+from utils.media_cache import get_media_key
+from utils.media_policy import media_kind as media_type
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    group_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    sender_id INTEGER,
+    date TEXT NOT NULL,
+    text TEXT,
+    reply_to_msg_id INTEGER,
+    reply_to_top_id INTEGER,
+    forum_topic INTEGER NOT NULL DEFAULT 0,
+    topic_title TEXT,
+    media_kind TEXT,
+    file_name TEXT,
+    media_key TEXT,
+    media_type TEXT,
+    mime_type TEXT,
+    file_size INTEGER,
+    PRIMARY KEY (group_id, id)
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    group_id INTEGER PRIMARY KEY,
+    max_id INTEGER NOT NULL
+);
+'''
+
+COLUMNS = ('id', 'sender_id', 'date', 'text', 'reply_to_msg_id', 'reply_to_top_id', 'forum_topic', 'topic_title', 'media_kind', 'file_name', 'media_key',
+           'media_type', 'mime_type', 'file_size')
+# Columns added after the first release, with their types, for indexes created before them
+ADDED_COLUMNS = (('media_type', 'TEXT'), ('mime_type', 'TEXT'), ('file_size', 'INTEGER'))
+
+
+class StoredReply:
+    __slots__ = ('reply_to_msg_id', 'reply_to_top_id', 'forum_topic')
+
+    def __init__(self, reply_to_msg_id, reply_to_top_id, forum_topic):
+        self.reply_to_msg_id = reply_to_msg_id
+        self.reply_to_top_id = reply_to_top_id
+        self.forum_topic = forum_topic
+
+
+class StoredTopicAction:
+    __slots__ = ('title',)
+
+    def __init__(self, title):
+        self.title = title
+
+
+class StoredFile:
+    __slots__ = ('name', 'mime_type', 'size')
+
+    def __init__(self, name, mime_type=None, size=None):
+        self.name = name
+        self.mime_type = mime_type
+        self.size = size
+
+
+class StoredMessage:
+    """
+    Message rebuilt from the index. Exposes the subset of telethon's Message
+    attributes that the chat log, topic resolver and media stages read, including
+    the media type flags, MIME type and size the media policy decides on.
+    media_type is None for rows stored before it was recorded.
+    """
+    __slots__ = ('id', 'sender_id', 'date', 'text', 'reply_to', 'action', 'photo', 'document', 'file', 'media_key',
+                 'media_type', 'sticker', 'voice', 'video', 'audio')
+
+    sender = None
+    video_note = None
+    gif = None
+
+    def __init__(self, row):
+        (self.id, self.sender_id, date, self.text, reply_to_msg_id, reply_to_top_id,
+         forum_topic, topic_title, media_kind, file_name, self.media_key,
+         self.media_type, mime_type, file_size) = row
+        self.date = datetime.datetime.fromisoformat(date)
+        self.reply_to = StoredReply(reply_to_msg_id, reply_to_top_id, bool(forum_topic)) if reply_to_msg_id or reply_to_top_id else None
+        self.action = StoredTopicAction(topic_title) if topic_title else None
+        self.photo = media_kind == 'photo'
+        self.document = media_kind == 'document'
+        self.file = StoredFile(file_name, mime_type, file_size) if media_kind else None
+        self.sticker = self.media_type == 'sticker'
+        self.voice = self.media_type == 'voice'
+        self.video = self.media_type == 'video'
+        self.audio = self.media_type == 'audio'
+
+
+def message_to_row(group_id, message):
+    reply_to = getattr(message, 'reply_to', None)
+    media_kind = 'photo' if message.photo else ('document' if message.document else None)
+    file_name = message.file.name if message.document and message.file else None
+    file = message.file if media_kind else None
+    return (
+        group_id,
+        message.id,
+        message.sender_id,
+        message.date.isoformat(),
+        message.text or None,
+        getattr(reply_to, 'reply_to_msg_id', None),
+        getattr(reply_to, 'reply_to_top_id', None),
+        1 if getattr(reply_to, 'forum_topic', False) else 0,
+        getattr(getattr(message, 'action', None), 'title', None),
+        media_kind,
+        file_name,
+        get_media_key(message),
+        media_type(message),
+        getattr(file, 'mime_type', None),
+        getattr(file, 'size', None),
+    )
+
+
+class MessageIndex:
+    """
+    Local SQLite copy of the message fields the chat log needs, so full backups can be
+    rendered from disk plus a delta fetch above the stored high-water mark.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Used from worker threads; every access goes through _lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            self.conn.executescript(SCHEMA)
+            existing = {row[1] for row in self.conn.execute('PRAGMA table_info(messages)')}
+            for column, column_type in ADDED_COLUMNS:
+                if column not in existing:
+                    self.conn.execute(f'ALTER TABLE messages ADD COLUMN {column} {column_type}')
+
+    def max_id(self, group_id):
+        """
+        High-water mark of a group: every message up to this id is stored.
+        Messages above it may be stored too, but with gaps (e.g. an interrupted fetch).
+        """
+        with self._lock:
+            row = self.conn.execute('SELECT max_id FROM watermarks WHERE group_id = ?', (group_id,)).fetchone()
+        return row[0] if row else 0
+
+    def set_max_id(self, group_id, max_id):
+        with self._lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO watermarks (group_id, max_id) VALUES (?, ?)', (group_id, max_id))
+
+    def add_messages(self, group_id, messages):
+        rows = [message_to_row(group_id, m) for m in messages]
+        with self._lock, self.conn:
+            self.conn.executemany(f'INSERT OR REPLACE INTO messages (group_id, {", ".join(COLUMNS)}) VALUES ({", ".join("?" * (len(COLUMNS) + 1))})', rows)
+
+    def load_messages(self, group_id, min_id=None, max_id=None):
+        """Stored messages of a group with min_id <= id <= max_id, newest first."""
+        query = f'SELECT {", ".join(COLUMNS)} FROM messages WHERE group_id = ?'
+        params = [group_id]
+        if min_id is not None:
+            query += ' AND id >= ?'
+            params.append(min_id)
+        if max_id is not None:
+            query += ' AND id <= ?'
+            params.append(max_id)
+        query += ' ORDER BY id DESC'
+        with self._lock:
+            rows = self.conn.execute(query, params).fetchall()
+        return [StoredMessage(row) for row in rows]
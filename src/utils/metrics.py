@@ -0,0 +1,230 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class StageStats:
+    __slots__ = ('first_start', 'last_end', 'busy_seconds', 'items', 'bytes')
+
+    def __init__(self):
+        self.first_start = None
+        self.last_end = None
+        self.busy_seconds = 0.0
+        self.items = 0
+        self.bytes = 0
+
+
+class Operation:
+    """Counts filled in by the code inside a timed block."""
+    __slots__ = ('items', 'bytes')
+
+    def __init__(self, items=0, bytes=0):
+        self.items = items
+        self.bytes = bytes
+
+
+class JobMetrics:
+    """
+    Durations and counters of one backup job, grouped by stage.
+    Stages of the streaming pipeline overlap, so each stage reports its wall-clock span
+    (first start to last end) and its busy time, the sum of its timed operations, which
+    exceeds the span when several workers run at once.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self.duration = None
+        self.status = None
+        self.stages = {}
+        # Free-form totals such as retries and FloodWait seconds
+        self.counters = defaultdict(float)
+        # The part of counters that came from process-wide events, already in the registry totals
+        self.shared_counters = defaultdict(float)
+        # Operations finish on worker threads as well as on the event loop
+        self._lock = threading.Lock()
+
+    def _stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = StageStats()
+        return stage
+
+    @contextmanager
+    def time(self, stage, items=0, bytes=0):
+        """Time the block as one operation of stage; set items/bytes on the yielded Operation."""
+        operation = Operation(items, bytes)
+        start = time.monotonic()
+        try:
+            yield operation
+        finally:
+            end = time.monotonic()
+            with self._lock:
+                stats = self._stage(stage)
+                stats.first_start = start if stats.first_start is None else min(stats.first_start, start)
+                stats.last_end = end if stats.last_end is None else max(stats.last_end, end)
+                stats.busy_seconds += end - start
+                stats.items += operation.items
+                stats.bytes += operation.bytes
+
+    def count(self, name, value=1, shared=False):
+        with self._lock:
+            self.counters[name] += value
+            if shared:
+                self.shared_counters[name] += value
+
+    def finish(self, status):
+        self.status = status
+        self.duration = time.monotonic() - self._started
+
+    def summary(self):
+        stages = {}
+        with self._lock:
+            for name, stats in self.stages.items():
+                span = stats.last_end - stats.first_start if stats.first_start is not None else 0.0
+                stages[name] = {
+                    'seconds': round(span, 3),
+                    'busy_seconds': round(stats.busy_seconds, 3),
+                    'items': stats.items,
+                    'bytes': stats.bytes,
+                    'items_per_second': round(stats.items / span, 2) if span else None,
+                    'bytes_per_second': round(stats.bytes / span) if span else None,
+                }
+            counters = dict(self.counters)
+        return {
+            'job': self.job,
+            'status': self.status,
+            'started_at': datetime.datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+            'duration_seconds': round(self.duration if self.duration is not None else time.monotonic() - self._started, 3),
+            'stages': stages,
+            'counters': counters,
+        }
+
+    def write(self, directory):
+        """Write the summary as JSON into directory and return the file path."""
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.datetime.fromtimestamp(self.started_at).strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(directory, f'{self.job}_{stamp}.json')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+
+class MetricsRegistry:
+    """
+    Totals over all jobs since startup, rendered in the Prometheus text format.
+    Jobs register while they run so process-wide events such as FloodWaits can be
+    attributed to them; the totals count each event once however many jobs saw it.
+    """
+
+    PREFIX = 'autocloud'
+
+    def __init__(self):
+        self.active = set()
+        self.jobs = defaultdict(int)
+        self.stage_seconds = defaultdict(float)
+        self.stage_busy_seconds = defaultdict(float)
+        self.stage_items = defaultdict(int)
+        self.stage_bytes = defaultdict(int)
+        self.counters = defaultdict(float)
+        self.last_duration = {}
+        self.last_finished = {}
+        self._lock = threading.Lock()
+
+    def start_job(self, job_metrics):
+        with self._lock:
+            self.active.add(job_metrics)
+
+    def finish_job(self, job_metrics):
+        summary = job_metrics.summary()
+        with self._lock:
+            self.active.discard(job_metrics)
+            self.jobs[(summary['job'], summary['status'])] += 1
+            for name, stage in summary['stages'].items():
+                self.stage_seconds[name] += stage['seconds']
+                self.stage_busy_seconds[name] += stage['busy_seconds']
+                self.stage_items[name] += stage['items']
+                self.stage_bytes[name] += stage['bytes']
+            for name, value in summary['counters'].items():
+                self.counters[name] += value - job_metrics.shared_counters.get(name, 0)
+            self.last_duration[summary['job']] = summary['duration_seconds']
+            self.last_finished[summary['job']] = time.time()
+
+    def count(self, name, value=1):
+        """Add a process-wide event to the totals once and to the counters of every running job."""
+        with self._lock:
+            active = list(self.active)
+            self.counters[name] += value
+        for job_metrics in active:
+            job_metrics.count(name, value, shared=True)
+
+    def render(self):
+        p = self.PREFIX
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {p}_{name} {help_text}')
+            lines.append(f'# TYPE {p}_{name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f'{p}_{name}{{{label_text}}} {value}' if label_text else f'{p}_{name} {value}')
+
+        with self._lock:
+            metric('jobs_total', 'counter', 'Finished backup jobs.', [({'job': job, 'status': status}, n) for (job, status), n in self.jobs.items()])
+            metric('stage_seconds_total', 'counter', 'Wall-clock seconds spent in each stage.', [({'stage': s}, round(v, 3)) for s, v in self.stage_seconds.items()])
+            metric('stage_busy_seconds_total', 'counter', 'Summed operation time of each stage across workers.', [({'stage': s}, round(v, 3)) for s, v in self.stage_busy_seconds.items()])
+            metric('stage_items_total', 'counter', 'Messages or files handled by each stage.', [({'stage': s}, v) for s, v in self.stage_items.items()])
+            metric('stage_bytes_total', 'counter', 'Bytes handled by each stage.', [({'stage': s}, v) for s, v in self.stage_bytes.items()])
+            metric('events_total', 'counter', 'Retries, FloodWait seconds and other job counters.', [({'name': n}, round(v, 3)) for n, v in self.counters.items()])
+            metric('last_job_duration_seconds', 'gauge', 'Duration of the last finished job of each kind.', [({'job': j}, v) for j, v in self.last_duration.items()])
+            metric('last_job_finished_timestamp_seconds', 'gauge', 'Unix time the last job of each kind finished.', [({'job': j}, round(v)) for j, v in self.last_finished.items()])
+            metric('jobs_running', 'gauge', 'Backup jobs currently running.', [({}, len(self.active))])
+        return '\n'.join(lines) + '\n'
+
+
+class TelethonEventHandler(logging.Handler):
+    """
+    Counts the requests telethon retries on Telegram server errors, which it handles
+    internally and only logs. FloodWaits are counted by the flood controller instead.
+    """
+
+    def __init__(self, registry):
+        super().__init__(level=logging.INFO)
+        self.registry = registry
+
+    def emit(self, record):
+        if not isinstance(record.msg, str):
+            return
+        if record.msg.startswith('Telegram is having internal issues'):
+            self.registry.count('telegram_retries')
+
+
+def watch_telethon(registry):
+    logging.getLogger('telethon').addHandler(TelethonEventHandler(registry))
+
+
+async def serve_prometheus(registry, host, port):
+    """Serve registry.render() over plain HTTP for Prometheus to scrape. Any path works."""
+    async def handle(reader, writer):
+        try:
+            while (await reader.readline()).strip():
+                pass
+            body = registry.render().encode()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                         + f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
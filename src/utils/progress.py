@@ -0,0 +1,145 @@
+import asyncio
+import sys
+import threading
+import time
+
+MB = 1024 * 1024
+
+
+class ProgressTracker:
+    """
+    Collects file and byte counts from every stage of a job and renders them as one line
+    at a fixed rate, instead of each progress callback printing its own bar. Counts may
+    be updated from any thread. On a terminal the line is redrawn in place; otherwise a
+    line is written only when something changed. on_update, if given, is awaited with
+    the rendered text at most every update_interval seconds (e.g. to edit a chat message).
+    """
+
+    def __init__(self, title, interval=2.0, on_update=None, update_interval=10.0, stream=None):
+        self.title = title
+        self.status = None
+        self.interval = interval
+        self.on_update = on_update
+        self.update_interval = update_interval
+        self.stream = stream or sys.stdout
+        # name -> [done, total or None, is_bytes]; rendered in insertion order
+        self.counters = {}
+        # key -> [label, current, total] of transfers in flight
+        self.transfers = {}
+        self._next_transfer = 0
+        self._lock = threading.Lock()
+        self._task = None
+        self._last_line = None
+        self._last_update = None
+        self._last_update_time = 0.0
+
+    def _counter(self, name, is_bytes):
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = [0, None, is_bytes]
+        return counter
+
+    def advance(self, name, amount=1, is_bytes=False):
+        with self._lock:
+            self._counter(name, is_bytes)[0] += amount
+
+    def add_total(self, name, amount, is_bytes=False):
+        with self._lock:
+            counter = self._counter(name, is_bytes)
+            counter[1] = (counter[1] or 0) + amount
+
+    def set_status(self, text):
+        self.status = text
+
+    def transfer(self, label):
+        """
+        Return a (current, total) callback for one upload or download. The transfer is
+        shown while it runs and its bytes are added to the label's byte counter when done.
+        """
+        with self._lock:
+            key = self._next_transfer
+            self._next_transfer += 1
+
+        finished = False
+
+        def callback(current, total):
+            nonlocal finished
+            with self._lock:
+                if finished:
+                    return
+                if total and current >= total:
+                    finished = True
+                    self.transfers.pop(key, None)
+                    self._counter(f'{label} MB', True)[0] += total
+                else:
+                    self.transfers[key] = [label, current, total]
+        return callback
+
+    def render(self):
+        parts = []
+        with self._lock:
+            for name, (done, total, is_bytes) in self.counters.items():
+                if is_bytes:
+                    value = f'{done / MB:.1f}' if total is None else f'{done / MB:.1f}/{total / MB:.1f}'
+                else:
+                    value = f'{done}' if total is None else f'{done}/{total}'
+                parts.append(f'{name} {value}')
+            # Transfers running in parallel are summed per label
+            active = {}
+            for label, current, total in self.transfers.values():
+                entry = active.setdefault(label, [0, 0, 0])
+                entry[0] += current
+                entry[1] += total or 0
+                entry[2] += 1
+            for label, (current, total, count) in active.items():
+                files = f' ({count} files)' if count > 1 else ''
+                parts.append(f'{label} {current / MB:.1f}/{total / MB:.1f} MB{files}')
+        line = f'[{self.title}] ' + ' | '.join(parts)
+        return f'{self.status}\n{line}' if self.status else line
+
+    def _write(self, text):
+        if self.stream.isatty():
+            self.stream.write('\r' + text.replace('\n', ' - ') + '\033[K')
+        else:
+            self.stream.write(text.replace('\n', ' - ') + '\n')
+        self.stream.flush()
+
+    async def _update(self, text, force=False):
+        now = time.monotonic()
+        if not self.on_update or text == self._last_update:
+            return
+        if not force and now - self._last_update_time < self.update_interval:
+            return
+        self._last_update = text
+        self._last_update_time = now
+        try:
+            await self.on_update(text)
+        except Exception:
+            # Progress reporting must never fail the job
+            pass
+
+    async def refresh(self, force=False):
+        text = self.render()
+        if text != self._last_line:
+            self._last_line = text
+            self._write(text)
+        await self._update(text, force=force)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.refresh()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop rendering and push the final state."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.refresh(force=True)
+        if self.stream.isatty():
+            self.stream.write('\n')
+            self.stream.flush()
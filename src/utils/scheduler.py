@@ -0,0 +1,74 @@
+import asyncio
+from utils.colorlog import logger
+
+
+class Job:
+    __slots__ = ('key', 'lane', 'run', 'done')
+
+    def __init__(self, key, run, lane=None):
+        self.key = key
+        # Jobs in the same lane never run at the same time; None runs in no lane
+        self.lane = lane
+        self.run = run
+        # Resolved with run()'s result, or None if the job failed
+        self.done = asyncio.get_running_loop().create_future()
+
+
+class JobScheduler:
+    """
+    Runs backup jobs in submission order, up to concurrency of them at once. Jobs in
+    the same lane (e.g. backups of the same group) run one after another, so they never
+    share the group's state. A job submitted while another with the same key is queued
+    or running is merged into that one instead of running twice.
+    """
+
+    def __init__(self, concurrency=1):
+        self.concurrency = max(1, concurrency)
+        # key -> job that is queued or running, in submission order
+        self.jobs = {}
+        self.running = set()
+        self._tasks = set()
+
+    def submit(self, key, run, lane=None):
+        """
+        Queue the coroutine function run under key. Returns (job, merged), where merged
+        is True if a job with this key was already queued or running.
+        """
+        job = self.jobs.get(key)
+        if job:
+            return job, True
+        job = Job(key, run, lane)
+        self.jobs[key] = job
+        self._dispatch()
+        return job, False
+
+    def jobs_ahead(self, job):
+        """Number of queued or running jobs submitted before job; 0 once it runs."""
+        if job in self.running:
+            return 0
+        return list(self.jobs.values()).index(job)
+
+    def _dispatch(self):
+        busy_lanes = {job.lane for job in self.running if job.lane is not None}
+        for job in list(self.jobs.values()):
+            if len(self.running) >= self.concurrency:
+                break
+            if job in self.running or job.lane in busy_lanes:
+                continue
+            self.running.add(job)
+            if job.lane is not None:
+                busy_lanes.add(job.lane)
+            task = asyncio.create_task(self._run(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job):
+        try:
+            job.done.set_result(await job.run())
+        except Exception as e:
+            logger.error(f'Backup job {job.key} failed: {e}')
+            job.done.set_result(None)
+        finally:
+            self.running.discard(job)
+            del self.jobs[job.key]
+            self._dispatch()
@@ -0,0 +1,96 @@
+import json
+import os
+from collections import OrderedDict
+
+
+def get_sender_name(sender, sender_id):
+    """Display name used in the chat log for a sender entity."""
+    name = getattr(sender, 'first_name', None) if sender else None
+    return name or str(sender_id)
+
+
+class SenderCache:
+    """
+    Bounded LRU cache of sender display names keyed by sender_id.
+    The cache is saved to a JSON file so later runs don't resolve the same users again.
+    """
+
+    def __init__(self, path, max_size=5000):
+        self.path = path
+        self.max_size = max_size
+        self.names = OrderedDict()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for sender_id, name in json.load(f).items():
+                    self.put(int(sender_id), name)
+        except Exception:
+            self.names.clear()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({str(k): v for k, v in self.names.items()}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def get(self, sender_id):
+        name = self.names.get(sender_id)
+        if name is not None:
+            self.names.move_to_end(sender_id)
+        return name
+
+    def put(self, sender_id, name):
+        self.names[sender_id] = name
+        self.names.move_to_end(sender_id)
+        while len(self.names) > self.max_size:
+            self.names.popitem(last=False)
+
+    async def resolve(self, client, messages, batch_size=100):
+        """
+        Make sure every sender in messages is cached. Senders already attached to a
+        message are used directly; the rest are looked up with batched get_entity calls,
+        leaving out ids the client cannot resolve so one of them does not fail the batch.
+        Returns a dict of sender_id -> name covering every sender in messages.
+        """
+        resolved = {}
+        missing = []
+        for message in messages:
+            sender_id = message.sender_id
+            if sender_id is None or sender_id in resolved:
+                continue
+            name = self.get(sender_id)
+            if name is None:
+                sender = getattr(message, 'sender', None)
+                if sender is not None:
+                    name = get_sender_name(sender, sender_id)
+                    self.put(sender_id, name)
+            if name is None:
+                resolved[sender_id] = str(sender_id)
+                missing.append(sender_id)
+            else:
+                resolved[sender_id] = name
+        for i in range(0, len(missing), batch_size):
+            batch = []
+            peers = []
+            for sender_id in missing[i:i + batch_size]:
+                try:
+                    peers.append(await client.get_input_entity(sender_id))
+                except Exception:
+                    # Unknown ids keep their numeric fallback and are retried next run
+                    continue
+                batch.append(sender_id)
+            if not batch:
+                continue
+            try:
+                entities = await client.get_entity(peers)
+            except Exception:
+                continue
+            for sender_id, sender in zip(batch, entities):
+                name = get_sender_name(sender, sender_id)
+                self.put(sender_id, name)
+                resolved[sender_id] = name
+        return resolved
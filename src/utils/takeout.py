@@ -0,0 +1,61 @@
+import asyncio
+from contextlib import asynccontextmanager
+from telethon import errors
+from utils.colorlog import logger
+
+
+class SharedTakeout:
+    """
+    One takeout session shared by every backup job running at the same time. Telegram
+    allows a single takeout per session, so the first job opens it, later jobs reuse it
+    and the last one to finish closes it, reporting success only if no job failed.
+    Falls back to the normal client if Telegram delays the takeout.
+    """
+
+    def __init__(self, client, **takeout_kwargs):
+        self.client = client
+        self.takeout_kwargs = takeout_kwargs
+        self.source = None
+        self.users = 0
+        self.failed = False
+        self._context = None
+        self._lock = asyncio.Lock()
+
+    async def _open(self):
+        if self.client.session.takeout_id is not None:
+            # Left over from a run that was cut short
+            await self.client.end_takeout(success=False)
+        context = self.client.takeout(finalize=True, **self.takeout_kwargs)
+        try:
+            self.source = await context.__aenter__()
+        except errors.TakeoutInitDelayError as e:
+            logger.warning(f'Telegram delays the takeout session by {e.seconds}s; exporting with the normal client.')
+            self.source = self.client
+            return
+        self._context = context
+        self.failed = False
+        logger.info('Exporting through a takeout session.')
+
+    async def _close(self):
+        context, self._context, self.source = self._context, None, None
+        if context:
+            error = RuntimeError('a backup job failed') if self.failed else None
+            await context.__aexit__(type(error) if error else None, error, None)
+
+    @asynccontextmanager
+    async def session(self):
+        async with self._lock:
+            if not self.users:
+                await self._open()
+            self.users += 1
+            source = self.source
+        try:
+            yield source
+        except BaseException:
+            self.failed = True
+            raise
+        finally:
+            async with self._lock:
+                self.users -= 1
+                if not self.users:
+                    await self._close()
@@ -0,0 +1,88 @@
+from telethon.tl.functions.channels import GetForumTopicsRequest
+from telethon.tl.types import ForumTopic
+
+GENERAL_TOPIC = 'General'
+
+
+async def fetch_forum_topics(client, group_id, page_size=100):
+    """
+    Return a dict of topic id -> title for every topic of a forum group,
+    paging through GetForumTopicsRequest. Non-forum groups yield an empty dict.
+    """
+    topic_map = {}
+    offset_date, offset_id, offset_topic = None, 0, 0
+    try:
+        while True:
+            result = await client(GetForumTopicsRequest(group_id, offset_date=offset_date, offset_id=offset_id, offset_topic=offset_topic, limit=page_size))
+            topics = [t for t in getattr(result, 'topics', []) if isinstance(t, ForumTopic)]
+            new_topics = [t for t in topics if t.id not in topic_map]
+            for topic in new_topics:
+                topic_map[topic.id] = topic.title
+            total = getattr(result, 'count', 0)
+            if not new_topics or len(topics) < page_size or len(topic_map) >= total:
+                break
+            last = topics[-1]
+            offset_date, offset_id, offset_topic = last.date, last.top_message, last.id
+    except Exception:
+        pass
+    return topic_map
+
+
+def get_forum_topic_id(message):
+    """Topic id taken straight from the message's reply header, or None outside forum topics."""
+    reply_to = getattr(message, 'reply_to', None)
+    if not reply_to or not getattr(reply_to, 'forum_topic', False):
+        return None
+    return getattr(reply_to, 'reply_to_top_id', None) or getattr(reply_to, 'reply_to_msg_id', None)
+
+
+class TopicResolver:
+    """
+    Assigns each message to a topic name in linear time.
+    Forum metadata on the message is used when present; otherwise the reply chain is
+    followed and the result is memoized for every message on the walked path, so each
+    message is resolved once and its descendants reuse the answer.
+    """
+
+    def __init__(self, messages, topic_map=None):
+        self.msg_id_map = {}
+        # Topic names keyed by topic id (= id of the message that created the topic)
+        self.topic_names = dict(topic_map or {})
+        for message in messages:
+            self.msg_id_map[message.id] = message
+            topic_name = getattr(getattr(message, 'action', None), 'title', None)
+            if topic_name:
+                self.topic_names[message.id] = topic_name
+        self.resolved = {}
+
+    def _direct_topic(self, message):
+        if message.id in self.topic_names:
+            return self.topic_names[message.id]
+        topic_id = get_forum_topic_id(message)
+        if topic_id is not None:
+            return self.topic_names.get(topic_id)
+        return None
+
+    def resolve(self, message):
+        path = []
+        on_path = set()
+        current = message
+        topic_name = None
+        while current is not None:
+            if current.id in self.resolved:
+                topic_name = self.resolved[current.id]
+                break
+            path.append(current.id)
+            on_path.add(current.id)
+            topic_name = self._direct_topic(current)
+            if topic_name:
+                break
+            reply_to = getattr(current, 'reply_to', None)
+            reply_to_msg_id = getattr(reply_to, 'reply_to_msg_id', None) if reply_to else None
+            if reply_to_msg_id in on_path:
+                break
+            current = self.msg_id_map.get(reply_to_msg_id) if reply_to_msg_id else None
+        topic_name = topic_name or GENERAL_TOPIC
+        for msg_id in path:
+            self.resolved[msg_id] = topic_name
+        return topic_name